@@ -0,0 +1,100 @@
+import time
+
+
+class Rejected:
+    """
+    Why a command wasn't admitted, and after how many seconds trying again makes sense
+    """
+
+    __slots__ = ("reason", "retry_after")
+
+    def __init__(self, reason: str, retry_after: float = 0):
+        # "user", "guild" or "busy"
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Admission:
+    """
+    Decides whether a slash command runs at all, before it does any work.
+
+    Each user has a token bucket of `user_burst` commands refilling at
+    `user_rate` per second, each guild may have at most `guild_max_in_flight`
+    commands running, and the whole bot at most `max_in_flight`. Anything over
+    a limit is rejected right away instead of queueing. 0 disables a limit.
+    """
+
+    def __init__(
+        self,
+        *,
+        user_rate: float = 0.5,
+        user_burst: int = 5,
+        guild_max_in_flight: int = 10,
+        max_in_flight: int = 200,
+        max_users: int = 10000,
+    ):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.guild_max_in_flight = guild_max_in_flight
+        self.max_in_flight = max_in_flight
+        # user id -> [tokens, updated], pruned once there are more than max_users
+        self.max_users = max_users
+        self.users = {}
+        # guild id -> commands running
+        self.guilds = {}
+        self.in_flight = 0
+
+    def admit(self, user_id: int, guild_id=None):
+        """
+        Admit a command, returning None if it may run (call release when it's
+        done) or Rejected if it may not
+        """
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return Rejected("busy")
+        running = self.guilds.get(guild_id, 0) if guild_id is not None else 0
+        if self.guild_max_in_flight and running >= self.guild_max_in_flight:
+            return Rejected("guild")
+        if self.user_rate:
+            wait = self._take(user_id, time.monotonic())
+            if wait:
+                return Rejected("user", wait)
+
+        self.in_flight += 1
+        if guild_id is not None:
+            self.guilds[guild_id] = running + 1
+        return None
+
+    def release(self, guild_id=None):
+        self.in_flight -= 1
+        if guild_id is not None:
+            running = self.guilds.pop(guild_id, 1) - 1
+            if running:
+                self.guilds[guild_id] = running
+
+    def _take(self, user_id: int, now: float) -> float:
+        """
+        Take a token from a user's bucket, 0 if there was one, otherwise the
+        seconds until there is
+        """
+        bucket = self.users.get(user_id)
+        if bucket is None:
+            if len(self.users) >= self.max_users:
+                self.prune(now)
+            bucket = self.users[user_id] = [self.user_burst, now]
+        tokens = min(self.user_burst, bucket[0] + (now - bucket[1]) * self.user_rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return (1 - tokens) / self.user_rate
+        bucket[0] = tokens - 1
+        return 0
+
+    def prune(self, now: float):
+        """
+        Forget the users whose buckets have refilled, they start out full anyway
+        """
+        self.users = {
+            user_id: bucket
+            for user_id, bucket in self.users.items()
+            if bucket[0] + (now - bucket[1]) * self.user_rate < self.user_burst
+        }
@@ -0,0 +1,322 @@
+import asyncio
+import multiprocessing
+import re
+import sqlite3
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import compress
+
+# Everything at module level here runs in the worker processes, so it only takes
+# and returns picklable values. The Analyzer at the bottom is the event loop side.
+
+ECO = re.compile(r'\[ECO "([^"]*)"\]')
+ECO_URL = re.compile(r'\[ECOUrl "[^"]*/openings/([^"]*)"\]')
+# comments like {[%clk 0:02:59.9]} and the move numbers left once they're gone
+COMMENT = re.compile(r"\{[^}]*\}")
+MOVE_NUMBER = re.compile(r"(\d+)\.(?!\.)")
+
+TIME_CLASSES = ("bullet", "blitz", "rapid", "daily", "unknown")
+COLOURS = ("white", "black")
+RESULTS = {"win": 1, "draw": 0, "loss": -1}
+
+
+def parse_pgn(pgn: str) -> tuple:
+    """
+    `(eco, opening, moves)` of a game from its PGN, moves counted in full moves
+    """
+    eco = ECO.search(pgn)
+    opening = ECO_URL.search(pgn)
+    # movetext starts after the blank line following the headers
+    movetext = COMMENT.sub("", pgn[pgn.find("\n\n") + 2 :])
+    numbers = MOVE_NUMBER.findall(movetext)
+    return (
+        eco.group(1) if eco else None,
+        opening.group(1).replace("-", " ") if opening else None,
+        int(numbers[-1]) if numbers else 0,
+    )
+
+
+def parse_pgns(pgns: list) -> list:
+    return [parse_pgn(pgn) if pgn else (None, None, 0) for pgn in pgns]
+
+
+class GameColumns:
+    """
+    A player's games as typed arrays, one per column, in end time order.
+
+    Strings (time classes, openings, opponents) are stored once and referenced
+    by index, so a game takes about 20 bytes and 50k games fit in about a MB.
+    Queries are scans over the arrays with compress/zip instead of per-game objects.
+    """
+
+    def __init__(self):
+        self.end_time = array("q")
+        self.time_class = array("B")
+        self.colour = array("B")
+        self.result = array("b")
+        self.rating = array("h")
+        self.opponent_rating = array("h")
+        self.moves = array("H")
+        self.opening = array("H")
+        self.opponent = array("I")
+        # index -> (eco, name) and index -> lowercase username, with reverse lookups
+        self.openings = []
+        self.opening_index = {}
+        self.opponents = []
+        self.opponent_index = {}
+
+    def __len__(self):
+        return len(self.end_time)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            column.itemsize * len(column)
+            for column in (
+                self.end_time,
+                self.time_class,
+                self.colour,
+                self.result,
+                self.rating,
+                self.opponent_rating,
+                self.moves,
+                self.opening,
+                self.opponent,
+            )
+        )
+
+    def append(self, row):
+        """
+        Add a `(end_time, time_class, colour, result, rating, opponent,
+        opponent_rating, eco, opening, moves)` row
+        """
+        (
+            end_time,
+            time_class,
+            colour,
+            result,
+            rating,
+            opponent,
+            opponent_rating,
+            eco,
+            opening,
+            moves,
+        ) = row
+        self.end_time.append(end_time)
+        self.time_class.append(
+            TIME_CLASSES.index(time_class) if time_class in TIME_CLASSES else 4
+        )
+        self.colour.append(COLOURS.index(colour))
+        self.result.append(RESULTS[result])
+        self.rating.append(rating or 0)
+        self.opponent_rating.append(opponent_rating or 0)
+        self.moves.append(min(moves or 0, 0xFFFF))
+        self.opening.append(intern(self.openings, self.opening_index, (eco, opening)))
+        self.opponent.append(
+            intern(self.opponents, self.opponent_index, (opponent or "").lower())
+        )
+
+    def mask(self, time_class: str = None) -> bytes:
+        """
+        One byte per game, 1 where the game is in `time_class` (every game for None)
+        """
+        if time_class is None:
+            return b"\x01" * len(self)
+        index = TIME_CLASSES.index(time_class)
+        # translate the time class column straight into a 0/1 selector
+        table = bytes(i == index for i in range(256))
+        return self.time_class.tobytes().translate(table)
+
+
+def intern(values: list, index: dict, value) -> int:
+    position = index.get(value)
+    if position is None:
+        position = index[value] = len(values)
+        values.append(value)
+    return position
+
+
+def load_columns(database: str, username: str) -> GameColumns:
+    """
+    Read a player's games from the database into columns, in a worker process
+    """
+    conn = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT end_time, time_class, colour, result, rating, opponent,"
+            " opponent_rating, eco, opening, moves FROM games WHERE username = ?"
+            " ORDER BY end_time",
+            (username,),
+        )
+        columns = GameColumns()
+        for row in rows:
+            columns.append(row)
+        return columns
+    finally:
+        conn.close()
+
+
+# the columns of recently analysed players in this worker, username ->
+# (version, GameColumns), so a query only sends the name and not the games
+RESIDENT = OrderedDict()
+
+
+def analyse_resident(database, username, version, cache_size, func, args):
+    """
+    func(columns, *args) over a player's games, in a worker process. The columns
+    are loaded into the worker's LRU unless it has them at `version` already.
+    """
+    entry = RESIDENT.get(username)
+    if entry is None or entry[0] != version:
+        entry = RESIDENT[username] = (version, load_columns(database, username))
+    RESIDENT.move_to_end(username)
+    if len(RESIDENT) > cache_size:
+        RESIDENT.popitem(last=False)
+    return func(entry[1], *args)
+
+
+def record(results) -> tuple:
+    """
+    `(wins, draws, losses)` of an iterable of results
+    """
+    # as bytes a loss (-1) is 0xFF, and bytes.count runs in C
+    results = array("b", results).tobytes()
+    return results.count(1), results.count(0), results.count(0xFF)
+
+
+def breakdown(columns: GameColumns) -> list:
+    """
+    `(time class, games, wins, draws, losses, average moves)` per time class played
+    """
+    rows = []
+    for time_class in TIME_CLASSES:
+        mask = columns.mask(time_class)
+        games = mask.count(1)
+        if not games:
+            continue
+        wins, draws, losses = record(compress(columns.result, mask))
+        moves = sum(compress(columns.moves, mask))
+        rows.append((time_class, games, wins, draws, losses, moves / games))
+    return rows
+
+
+def openings(columns: GameColumns, time_class: str = None, limit: int = 10) -> list:
+    """
+    `(eco, name, games, wins, draws, losses)` of the most played openings
+    """
+    mask = columns.mask(time_class)
+    counts = {}
+    for opening, result in zip(
+        compress(columns.opening, mask), compress(columns.result, mask)
+    ):
+        # [games, wins, draws, losses]
+        tally = counts.get(opening)
+        if tally is None:
+            tally = counts[opening] = [0, 0, 0, 0]
+        tally[0] += 1
+        tally[2 - result] += 1
+    top = sorted(counts.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+    return [columns.openings[opening] + tuple(tally) for opening, tally in top]
+
+
+def head_to_head(columns: GameColumns, opponent: str) -> tuple:
+    """
+    `(games, wins, draws, losses, last end time, by time class)` against one
+    opponent, by time class as `(time class, wins, draws, losses)` rows
+    """
+    index = columns.opponent_index.get(opponent.lower())
+    if index is None:
+        return 0, 0, 0, 0, None, []
+    mask = bytes(o == index for o in columns.opponent)
+    games = mask.count(1)
+    wins, draws, losses = record(compress(columns.result, mask))
+    last = max(compress(columns.end_time, mask))
+    tallies = {}
+    for time_class, result in zip(
+        compress(columns.time_class, mask), compress(columns.result, mask)
+    ):
+        # [wins, draws, losses]
+        tally = tallies.setdefault(time_class, [0, 0, 0])
+        tally[1 - result] += 1
+    by_time_class = [
+        (TIME_CLASSES[time_class],) + tuple(tally)
+        for time_class, tally in sorted(tallies.items())
+    ]
+    return games, wins, draws, losses, last, by_time_class
+
+
+class Analyzer:
+    """
+    Runs PGN parsing and the aggregations over GameColumns in a process pool,
+    so they never block the event loop.
+
+    Each worker keeps the columns of the `cache_size` players it analysed last.
+    Ingesting new games for a player bumps their version, which makes the
+    workers load them again.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        *,
+        workers: int = 2,
+        cache_size: int = 32,
+        max_versions: int = 4096,
+    ):
+        self.database = database
+        self.workers = workers
+        self.cache_size = cache_size
+        # username -> version of the players invalidated since `base` became the
+        # version of everyone else, cleared once there are more than max_versions
+        self.versions = {}
+        self.generation = 0
+        self.base = 0
+        self.max_versions = max_versions
+        self.executor = None
+
+    async def run(self, func, *args):
+        """
+        Run func(*args) in a worker process
+        """
+        if self.executor is None:
+            # spawned, so the workers don't inherit the bot's loop and connections
+            self.executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def parse(self, pgns: list) -> list:
+        """
+        `(eco, opening, moves)` for every PGN
+        """
+        return await self.run(parse_pgns, pgns)
+
+    def invalidate(self, username: str):
+        self.generation += 1
+        if len(self.versions) >= self.max_versions:
+            # everything the workers hold is older than this
+            self.versions.clear()
+            self.base = self.generation
+        else:
+            self.versions[username] = self.generation
+
+    async def analyse(self, username: str, func, *args):
+        """
+        func(columns, *args) over a player's games, e.g. `analyse(name, openings)`
+        """
+        version = self.versions.get(username, self.base)
+        return await self.run(
+            analyse_resident,
+            self.database,
+            username,
+            version,
+            self.cache_size,
+            func,
+            args,
+        )
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import re
+import time
+from collections import OrderedDict
+
+from chesscom import ChessComClient, normalise
+from models import Game
+
+# paths of a player's archive list and of one month, e.g. month="2024/05"
+ARCHIVES = "/player/{username}/games/archives"
+MONTH = "/player/{username}/games/{month}"
+
+# the bytes the splitter cares about outside and inside strings
+STRUCTURE = re.compile(rb'["\\{}\[\]]')
+STRING_END = re.compile(rb'["\\]')
+
+
+class GameSplitter:
+    """
+    Splits a month body, `{"games": [{...}, {...}]}`, into its game objects as the
+    chunks arrive, so a month is never held or decoded as a whole.
+
+    Only brackets and strings are tracked, each complete object in the first
+    array is handed to json.loads on its own.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # scan position in the buffer and where the current game started
+        self.pos = 0
+        self.start = None
+        self.depth = 0
+        self.in_string = False
+        self.in_array = False
+
+    def feed(self, chunk: bytes) -> list:
+        """
+        Add a chunk and return the games completed by it, decoded
+        """
+        self.buffer += chunk
+        buffer = self.buffer
+        games = []
+        pos = self.pos
+        while True:
+            if self.in_string:
+                match = STRING_END.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                    break
+                if match.group() == b"\\":
+                    if match.end() == len(buffer):
+                        # the escaped byte is in the next chunk
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self.in_string = False
+                pos = match.end()
+                continue
+
+            match = STRUCTURE.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            char = match.group()
+            pos = match.end()
+            if char == b'"':
+                self.in_string = True
+            elif char in b"{[":
+                self.depth += 1
+                if char == b"[" and self.depth == 2 and self.start is None:
+                    self.in_array = True
+                elif char == b"{" and self.depth == 3 and self.in_array:
+                    self.start = match.start()
+            else:
+                if char == b"}" and self.depth == 3 and self.start is not None:
+                    games.append(json.loads(buffer[self.start : pos]))
+                    self.start = None
+                elif char == b"]" and self.depth == 2:
+                    self.in_array = False
+                self.depth -= 1
+
+        # drop everything before the game in progress
+        keep = self.start if self.start is not None else pos
+        del buffer[:keep]
+        self.pos = pos - keep
+        if self.start is not None:
+            self.start = 0
+        return games
+
+
+class ArchiveIngester:
+    """
+    Walks a player's monthly game archives into the Store.
+
+    Months are ingested newest first and checkpointed once all their games are
+    saved. A finished month never changes, so it's never fetched again, and an
+    interrupted ingestion picks up at the first month without a checkpoint. The
+    current month is re-fetched (conditionally) once it's older than `refresh`.
+    """
+
+    def __init__(
+        self,
+        chesscom: ChessComClient,
+        store,
+        *,
+        analyzer=None,
+        refresh: float = 600,
+        batch_size: int = 500,
+        chunk_size: int = 1 << 16,
+        max_players: int = 1000,
+    ):
+        self.chesscom = chesscom
+        self.store = store
+        # optional Analyzer the PGNs are parsed by, and told about new games
+        self.analyzer = analyzer
+        self.refresh = refresh
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        # username -> (months, running ingestion), so concurrent commands share it
+        self.running = {}
+        # username -> (months ingested, months in the archive list), and
+        # username -> (when, months) of the last archive list, both for the
+        # `max_players` most recently ingested players
+        self.max_players = max_players
+        self.progress = OrderedDict()
+        self.lists = OrderedDict()
+
+    async def ingest(self, username: str, requester=None, *, months: int = None):
+        """
+        Ingest the latest `months` archives of a player (all of them by default)
+        """
+        username = normalise(username)
+        while True:
+            running = self.running.get(username)
+            if running is None:
+                task = asyncio.ensure_future(self._ingest(username, requester, months))
+                self.running[username] = (months, task)
+                task.add_done_callback(lambda t: self._finish(username, t))
+                break
+            covered, task = running
+            if covered is None or (months is not None and covered >= months):
+                break
+            # a smaller ingestion is running, run after it so the months it
+            # checkpoints aren't fetched twice
+            await asyncio.wait({task})
+        # shielded so a command giving up doesn't stop the ingestion for others
+        await asyncio.shield(task)
+
+    def _finish(self, username: str, task: asyncio.Task):
+        if self.running.get(username, (None, None))[1] is task:
+            del self.running[username]
+
+    async def _ingest(self, username: str, requester, months):
+        available = await self.months(username, requester)
+        current = time.strftime("%Y/%m", time.gmtime())
+        await self.store.use_archives(username)
+        checkpoints = await self.store.load_archives(username)
+        loaded = {month for month in available if month in checkpoints}
+        self._remember(self.progress, username, (len(loaded), len(available)))
+
+        for month in reversed(available[-months:] if months else available):
+            complete, etag, fetched_at = checkpoints.get(month, (False, None, 0))
+            if complete:
+                continue
+            if month == current and time.time() - fetched_at < self.refresh:
+                continue
+            await self._ingest_month(username, month, requester, etag)
+            loaded.add(month)
+            self._remember(self.progress, username, (len(loaded), len(available)))
+
+    async def months(self, username: str, requester=None) -> list:
+        """
+        The months a player has archives for, oldest first. The list only grows
+        when a new month starts, so it's kept for `refresh` seconds.
+        """
+        fetched_at, available = self.lists.get(username, (0, None))
+        if available is not None and time.monotonic() - fetched_at < self.refresh:
+            return available
+        body = await self.chesscom.get_json(
+            ARCHIVES.format(username=username), requester
+        )
+        # archive urls end in /games/YYYY/MM
+        available = ["/".join(url.split("/")[-2:]) for url in body.get("archives", [])]
+        self._remember(self.lists, username, (time.monotonic(), available))
+        return available
+
+    def _remember(self, players: OrderedDict, username: str, value):
+        players[username] = value
+        players.move_to_end(username)
+        if len(players) > self.max_players:
+            players.popitem(last=False)
+
+    async def _ingest_month(self, username: str, month: str, requester, etag):
+        is_past = month != time.strftime("%Y/%m", time.gmtime())
+        batch = []
+        # whether any game was saved, the batches are cleared as they're saved
+        saved = False
+
+        async def read(resp):
+            nonlocal saved
+            # a retried request starts over, the games already saved are upserted
+            splitter = GameSplitter()
+            batch.clear()
+            async for chunk in resp.content.iter_chunked(self.chunk_size):
+                for data in splitter.feed(chunk):
+                    game = Game.from_json(data, username)
+                    if game is not None:
+                        batch.append((game, data.get("pgn")))
+                if len(batch) >= self.batch_size:
+                    await self.store.save_games(username, await self.rows(batch))
+                    batch.clear()
+                    saved = True
+
+        status, headers, _ = await self.chesscom.request(
+            MONTH.format(username=username, month=month),
+            {"If-None-Match": etag} if etag else None,
+            requester,
+            "archive",
+            read,
+        )
+        # the checkpoint lands together with the last batch
+        await self.store.save_games(
+            username,
+            await self.rows(batch),
+            month,
+            complete=is_past,
+            etag=headers.get("ETag") or etag,
+        )
+        if self.analyzer is not None and (saved or batch):
+            self.analyzer.invalidate(username)
+
+    async def rows(self, batch) -> list:
+        """
+        Game rows for `(game, pgn)` pairs, with the PGNs parsed off the event loop
+        """
+        if self.analyzer is not None and batch:
+            parsed = await self.analyzer.parse([pgn for _, pgn in batch])
+            for (game, _), (eco, opening, moves) in zip(batch, parsed):
+                game.eco = eco
+                game.opening = opening
+                game.moves = moves
+        return [game.to_row() for game, _ in batch]
+
+    def ingested(self, username: str):
+        """
+        `(months ingested, months available)` of the last run for a player
+        """
+        return self.progress.get(normalise(username))
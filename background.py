@@ -0,0 +1,18 @@
+import asyncio
+
+# The event loop only keeps weak references to tasks, so a task nothing else
+# refers to can be garbage collected before it finishes. Background tasks are
+# referenced here (or in a set of their owner's) until they're done.
+TASKS = set()
+
+
+def spawn(coro, tasks: set = TASKS) -> asyncio.Task:
+    """
+    Run a coroutine as a background task, referenced in `tasks` until it's done.
+    Owners that wait for or cancel their background work on close pass a set of
+    their own.
+    """
+    task = asyncio.ensure_future(coro)
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+    return task
@@ -0,0 +1,83 @@
+import time
+
+import discord
+
+
+class FakeResponse:
+    """
+    Stands in for `discord.InteractionResponse`
+    """
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def send_message(self, content=None, *, embed=None, ephemeral=False, **_):
+        self.done = True
+        self.interaction.acknowledged(embed)
+        self.interaction.delivered(embed)
+
+    async def defer(self, *, ephemeral=False, thinking=False):
+        self.done = True
+        self.interaction.acknowledged(None)
+
+
+class FakeFollowup:
+    """
+    Stands in for the interaction's followup `discord.Webhook`
+    """
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, *, embed=None, ephemeral=False, **_):
+        # the "still working" notice is not the result
+        if embed is not None and embed.title != "Still working on it":
+            self.interaction.delivered(embed)
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.mention = f"<@{user_id}>"
+
+
+class FakeInteraction:
+    """
+    Just enough of `discord.Interaction` to drive the bot's slash command
+    callbacks, recording when the interaction was acknowledged and answered
+    """
+
+    def __init__(self, *, guild_id: int = None, user_id: int = 1):
+        self.guild_id = guild_id
+        self.guild = None
+        self.user = FakeUser(user_id)
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.started = time.perf_counter()
+        self.acknowledged_at = None
+        self.delivered_at = None
+        self.embed = None
+        self.edits = 0
+
+    def acknowledged(self, embed: discord.Embed):
+        if self.acknowledged_at is None:
+            self.acknowledged_at = time.perf_counter()
+
+    def delivered(self, embed: discord.Embed):
+        if self.delivered_at is None:
+            self.delivered_at = time.perf_counter()
+        self.embed = embed
+
+    async def edit_original_response(self, *, embed=None, **_):
+        self.edits += 1
+        self.delivered(embed)
+
+    async def delete_original_response(self):
+        pass
+
+    async def original_response(self):
+        return None
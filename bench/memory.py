@@ -0,0 +1,77 @@
+"""
+Compare the memory a cached player takes as decoded JSON and as the parsed models.
+
+    python bench/memory.py --players 10000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from models import PlayerProfile, PlayerStats  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_bodies(players: int):
+    """
+    Raw response bodies for distinct players, so nothing is shared between them
+    """
+    with open(os.path.join(FIXTURES, "profile.json")) as f:
+        profile = f.read()
+    with open(os.path.join(FIXTURES, "stats.json")) as f:
+        stats = f.read()
+    return [
+        (profile.replace("ikaru", f"ikaru{i}"), stats.replace("2820", str(2000 + i)))
+        for i in range(players)
+    ]
+
+
+def measure(bodies, build) -> int:
+    """
+    Bytes still allocated after building and keeping one entry per player
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(profile, stats) for profile, stats in bodies]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return after - before
+
+
+def as_json(profile: str, stats: str):
+    return json.loads(profile), json.loads(stats)
+
+
+def as_models(profile: str, stats: str):
+    return (
+        PlayerProfile.from_json(json.loads(profile)),
+        PlayerStats.from_json(json.loads(stats)),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=10000)
+    args = parser.parse_args()
+
+    bodies = load_bodies(args.players)
+    results = {
+        "json": measure(bodies, as_json),
+        "models": measure(bodies, as_models),
+    }
+    for name, total in results.items():
+        print(
+            f"{name:>6}: {total / 1024 / 1024:8.2f} MiB total, "
+            f"{total / args.players:8.0f} bytes per player"
+        )
+    print(f"models use {results['models'] / results['json']:.1%} of the JSON memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Benchmark the bot's slash commands against a local chess.com stand-in.
+
+    python bench/run.py --levels 1 8 32 128 --commands 500 --output bench_results.json
+
+Each concurrency level starts with empty caches and runs the lookup commands
+through fake interactions. The report has p50/p95/p99 latency until the
+interaction was acknowledged and until the answer was delivered, plus commands
+per second.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+# keep the benchmark away from the real database
+os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import bot  # noqa: E402
+from interaction import FakeInteraction  # noqa: E402
+from server import StandIn  # noqa: E402
+
+# how often each command is run, roughly what the bot sees in practice
+COMMANDS = {
+    "chess": 40,
+    "rapid": 20,
+    "blitz": 20,
+    "bullet": 10,
+    "daily": 5,
+    "puzzle": 5,
+}
+
+
+def percentiles(samples) -> dict:
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    samples = sorted(samples)
+
+    def at(q):
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 2)
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99)}
+
+
+def version() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=HERE,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def workload(commands: int, players: int, seed: int):
+    """
+    (command, username) pairs. Usernames are Zipf distributed like real lookups,
+    a few popular players and a long tail.
+    """
+    rng = random.Random(seed)
+    names = [f"player{i}" for i in range(players)]
+    weights = [1 / (rank + 1) for rank in range(players)]
+    return list(
+        zip(
+            rng.choices(list(COMMANDS), weights=list(COMMANDS.values()), k=commands),
+            rng.choices(names, weights=weights, k=commands),
+        )
+    )
+
+
+async def reset():
+    """
+    Start a level with cold caches, in memory and on disk
+    """
+    chesscom = bot.client.chesscom
+    await asyncio.gather(*chesscom.background, return_exceptions=True)
+    chesscom.cache.entries.clear()
+    await bot.client.store.run(
+        lambda conn: (conn.execute("DELETE FROM responses"), conn.commit())
+    )
+
+
+async def run_level(concurrency: int, jobs, stand_in: StandIn) -> dict:
+    await reset()
+    requests_before = stand_in.requests
+    statuses_before = dict(stand_in.statuses)
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    interactions = []
+    errors = 0
+
+    async def worker(worker_id: int):
+        nonlocal errors
+        while not queue.empty():
+            command, username = queue.get_nowait()
+            # spread the load over a few guilds like the real bot sees it
+            interaction = FakeInteraction(guild_id=worker_id % 4, user_id=worker_id)
+            callback = bot.client.tree.get_command(command).callback
+            try:
+                await callback(interaction, username)
+            except Exception:
+                errors += 1
+            interactions.append(interaction)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ack = [i.acknowledged_at - i.started for i in interactions if i.acknowledged_at]
+    done = [i.delivered_at - i.started for i in interactions if i.delivered_at]
+    statuses = {
+        str(status): count - statuses_before.get(status, 0)
+        for status, count in stand_in.statuses.items()
+    }
+    return {
+        "concurrency": concurrency,
+        "commands": len(interactions),
+        "seconds": round(elapsed, 3),
+        "commands_per_second": round(len(interactions) / elapsed, 2),
+        "acknowledged_ms": percentiles(ack),
+        "delivered_ms": percentiles(done),
+        "undelivered": len(interactions) - len(done),
+        "errors": errors,
+        "upstream_requests": stand_in.requests - requests_before,
+        "upstream_statuses": statuses,
+    }
+
+
+async def benchmark(args) -> dict:
+    stand_in = StandIn(
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        not_found=args.not_found,
+        burst_every=args.burst_every,
+        burst_length=args.burst_length,
+    )
+    base_url = await stand_in.start()
+    client = bot.client
+    client.chesscom.base_url = base_url
+    await client.store.open()
+    await client.chesscom.start()
+    try:
+        levels = []
+        for concurrency in args.levels:
+            jobs = workload(args.commands, args.players, args.seed)
+            result = await run_level(concurrency, jobs, stand_in)
+            levels.append(result)
+            print(
+                f"concurrency {concurrency:>4}: "
+                f"{result['commands_per_second']:>8.1f} commands/s, delivered "
+                f"p50 {result['delivered_ms']['p50']}ms "
+                f"p95 {result['delivered_ms']['p95']}ms "
+                f"p99 {result['delivered_ms']['p99']}ms, "
+                f"{result['upstream_requests']} upstream requests"
+            )
+    finally:
+        await client.chesscom.close()
+        await client.store.close()
+        await stand_in.stop()
+
+    return {
+        "version": version(),
+        "timestamp": int(time.time()),
+        "config": {
+            "commands": args.commands,
+            "players": args.players,
+            "latency_ms": args.latency,
+            "jitter_ms": args.jitter,
+            "not_found": args.not_found,
+            "burst_every": args.burst_every,
+            "burst_length": args.burst_length,
+            "seed": args.seed,
+        },
+        "levels": levels,
+    }
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--commands", type=int, default=500, help="per level")
+    parser.add_argument("--players", type=int, default=200, help="distinct usernames")
+    parser.add_argument("--latency", type=float, default=80, help="upstream ms")
+    parser.add_argument("--jitter", type=float, default=20, help="upstream ms")
+    parser.add_argument("--not-found", type=float, default=0.05, help="share, 0-1")
+    parser.add_argument("--burst-every", type=float, default=0, help="429 seconds")
+    parser.add_argument("--burst-length", type=float, default=1, help="429 seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    results = asyncio.run(benchmark(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,128 @@
+"""
+Local stand-in for the chess.com public API, serving the recorded fixtures.
+
+    python bench/server.py --port 8080 --latency 80 --not-found 0.05
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+class StandIn:
+    """
+    Serves `/pub/player/{username}` and `/pub/player/{username}/stats` for any
+    username from the fixtures, with configurable latency and failures
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.08,
+        jitter: float = 0.02,
+        not_found: float = 0.0,
+        burst_every: float = 0,
+        burst_length: float = 1,
+        retry_after: int = 1,
+    ):
+        # seconds of latency (plus up to jitter), share of usernames that 404, and
+        # every burst_every seconds a burst_length window in which everything 429s
+        self.latency = latency
+        self.jitter = jitter
+        self.not_found = not_found
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        self.started = time.monotonic()
+        self.requests = 0
+        self.statuses = {}
+        with open(os.path.join(FIXTURES, "profile.json")) as f:
+            self.profile = json.load(f)
+        with open(os.path.join(FIXTURES, "stats.json")) as f:
+            self.stats = json.load(f)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/pub/player/{username}", self.player)
+        app.router.add_get("/pub/player/{username}/stats", self.player)
+        return app
+
+    def in_burst(self) -> bool:
+        if not self.burst_every:
+            return False
+        return (time.monotonic() - self.started) % self.burst_every < self.burst_length
+
+    def missing(self, username: str) -> bool:
+        # deterministic per username, so a missing player stays missing
+        return username.startswith("missing") or (
+            random.Random(username).random() < self.not_found
+        )
+
+    async def player(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        username = request.match_info["username"]
+        if self.in_burst():
+            response = web.Response(
+                status=429, headers={"Retry-After": str(self.retry_after)}
+            )
+        elif self.missing(username):
+            response = web.Response(status=404)
+        elif request.path.endswith("/stats"):
+            response = web.json_response(self.stats, headers={"ETag": '"stats"'})
+        else:
+            profile = dict(self.profile)
+            profile["url"] = f"https://www.chess.com/member/{username}"
+            profile["username"] = username.lower()
+            response = web.json_response(profile, headers={"ETag": '"profile"'})
+        etag = response.headers.get("ETag")
+        if etag and request.headers.get("If-None-Match") == etag:
+            response = web.Response(status=304)
+        self.statuses[response.status] = self.statuses.get(response.status, 0) + 1
+        return response
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        Start serving in the running event loop and return the API root URL
+        """
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return f"http://{host}:{port}/pub"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=80, help="ms")
+    parser.add_argument("--jitter", type=float, default=20, help="ms")
+    parser.add_argument("--not-found", type=float, default=0.0, help="share, 0-1")
+    parser.add_argument("--burst-every", type=float, default=0, help="seconds")
+    parser.add_argument("--burst-length", type=float, default=1, help="seconds")
+    args = parser.parse_args()
+
+    stand_in = StandIn(
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        not_found=args.not_found,
+        burst_every=args.burst_every,
+        burst_length=args.burst_length,
+    )
+    web.run_app(stand_in.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
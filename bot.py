@@ -0,0 +1,1313 @@
+import time
+
+# taken before the heavy imports, so the startup time logged once the bot is
+# ready is close to the time since the process was launched
+LAUNCHED = time.monotonic()
+
+import asyncio
+import functools
+from typing import Optional
+import discord
+from discord import app_commands
+
+from dotenv import load_dotenv
+import os
+
+import analysis
+import charts
+import metrics
+from admission import Admission
+from analysis import Analyzer
+from archives import ArchiveIngester
+from background import spawn
+from bulkimport import BulkImport, parse_csv
+from charts import ImageCache
+from chesscom import (
+    ChessComClient,
+    ChessComError,
+    PlayerNotFound,
+    Player,
+    RateLimited,
+    normalise,
+)
+from leaderboard import Leaderboards
+from links import LinkRegistry
+from models import Game
+from nicksync import NicknameSync
+from prefetch import Prefetcher
+from presence import PresenceTracker
+from ratelimit import RateLimiter, SharedRateLimiter
+from render import (
+    TIME_CONTROLS,
+    TimeControl,
+    charts_unavailable,
+    nickname,
+    not_found_games,
+    render_breakdown,
+    render_colours,
+    render_compare,
+    render_form,
+    render_head_to_head,
+    render_history,
+    render_import,
+    render_leaderboard,
+    render_mode,
+    render_openings,
+    render_overview,
+    render_puzzle,
+    render_trend,
+)
+from responses import Reply, respond, send
+from store import Store
+from treesync import sync_if_changed
+from usernames import UsernameIndex
+
+load_dotenv()
+
+
+# Guilds the commands are synced to right away, comma separated. Global commands
+# are only synced with SYNC_GLOBAL=1, they can take up to an hour to show up.
+GUILDS = [
+    discord.Object(id=int(guild_id))
+    for guild_id in os.getenv("GUILD_IDS", "1100504969746071602").split(",")
+    if guild_id.strip()
+]
+SYNC_GLOBAL = os.getenv("SYNC_GLOBAL", "0") == "1"
+# Only one process of a sharded deployment needs to sync the commands
+SYNC_COMMANDS = os.getenv("SYNC_COMMANDS", "1") == "1"
+
+# The shards this process runs, comma separated, out of SHARD_COUNT. Unset runs all
+# of them in this process, as many as Discord recommends. launcher.py sets these
+# to split the shards over several processes.
+SHARD_IDS = [
+    int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id
+] or None
+# "auto" (what launcher.py defaults to) leaves the count to Discord, like unset
+SHARD_COUNT = os.getenv("SHARD_COUNT", "").strip().lower()
+SHARD_COUNT = int(SHARD_COUNT) if SHARD_COUNT not in ("", "auto") else None
+# Other processes use the same database: share the chess.com rate limit and
+# responses through it, and pick up their account links
+SHARED_STORE = os.getenv("SHARED_STORE", "0") == "1"
+
+# How long (in seconds) past its TTL a cached player may still be shown while it's
+# refreshed in the background, per command. 0 always waits for fresh data.
+MAX_STALE = {"chess": 3600, "daily": 3600, "daily960": 3600, "puzzle": 3600}
+
+
+def max_stale(command: str) -> float:
+    return float(
+        os.getenv(f"MAX_STALE_{command.upper()}", MAX_STALE.get(command, 1800))
+    )
+
+
+# /import attachments larger than this are refused, and progress is reported this
+# often (in seconds). Interaction tokens expire after 15 minutes, past
+# IMPORT_TOKEN_WINDOW the report is posted in the channel instead.
+IMPORT_MAX_BYTES = 1024 * 1024
+IMPORT_PROGRESS_INTERVAL = 3
+IMPORT_TOKEN_WINDOW = 14 * 60
+
+
+class InstrumentedTree(app_commands.CommandTree):
+    """
+    CommandTree that turns away slash commands over the admission limits, and
+    records how long the others take and how they ended
+    """
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.type is not discord.InteractionType.application_command:
+            return True
+        rejected = self.client.admission.admit(
+            interaction.user.id, interaction.guild_id
+        )
+        if rejected is not None:
+            command = interaction.data.get("name", "unknown")
+            metrics.admission_rejections.inc(command, rejected.reason)
+            await send(interaction, rejected_reply(rejected))
+            return False
+        interaction.extras["admitted"] = True
+        interaction.extras["started"] = time.perf_counter()
+        metrics.commands_in_flight.inc()
+        return True
+
+    async def on_error(
+        self, interaction: discord.Interaction, error: app_commands.AppCommandError
+    ):
+        finish_command(interaction, "error")
+        await super().on_error(interaction, error)
+
+
+def finish_command(interaction: discord.Interaction, outcome: str):
+    if interaction.extras.pop("admitted", False):
+        client.admission.release(interaction.guild_id)
+    started = interaction.extras.pop("started", None)
+    if started is None:
+        return
+    command = interaction.command.qualified_name if interaction.command else "unknown"
+    metrics.commands_in_flight.dec()
+    metrics.command_seconds.observe(time.perf_counter() - started, command)
+    metrics.commands_total.inc(command, outcome)
+
+
+class MyClient(discord.AutoShardedClient):
+    def __init__(self, *, intents: discord.Intents):
+        super().__init__(intents=intents, shard_ids=SHARD_IDS, shard_count=SHARD_COUNT)
+        # A CommandTree is a special type that holds all the application command
+        # state required to make it work. This is a separate class because it
+        # allows all the extra state to be opt-in.
+        # Whenever you want to work with application commands, your tree is used
+        # to store and work with them.
+        # Note: When using commands.Bot instead of discord.Client, the bot will
+        # maintain its own tree instead.
+        self.tree = InstrumentedTree(self)
+        # per user, per guild and global limits on running slash commands
+        self.admission = Admission(
+            user_rate=float(os.getenv("USER_COMMAND_RATE", 0.5)),
+            user_burst=int(os.getenv("USER_COMMAND_BURST", 5)),
+            guild_max_in_flight=int(os.getenv("GUILD_MAX_IN_FLIGHT", 10)),
+            max_in_flight=int(os.getenv("MAX_IN_FLIGHT", 200)),
+        )
+        # Local database the chess.com cache is persisted to, so restarts start warm
+        self.store = Store(
+            os.getenv("DATABASE_PATH", "chess.db"),
+            max_responses=int(os.getenv("DATABASE_MAX_RESPONSES", 50000)),
+            max_archive_players=int(os.getenv("DATABASE_MAX_ARCHIVE_PLAYERS", 1000)),
+        )
+        # with other processes on the database, the limit is for all of them together
+        if SHARED_STORE:
+            limiter = functools.partial(SharedRateLimiter, self.store)
+        else:
+            limiter = RateLimiter
+        # Shared chess.com API client, created in setup_hook so its connection
+        # pool lives on the bot's event loop and is reused by every command.
+        self.chesscom = ChessComClient(
+            base_url=os.getenv("CHESSCOM_BASE_URL", "https://api.chess.com/pub"),
+            pool_size=int(os.getenv("CHESSCOM_POOL_SIZE", 20)),
+            keepalive=float(os.getenv("CHESSCOM_KEEPALIVE", 30)),
+            dns_ttl=int(os.getenv("CHESSCOM_DNS_TTL", 300)),
+            timeout=float(os.getenv("CHESSCOM_TIMEOUT", 10)),
+            cache_size=int(os.getenv("CHESSCOM_CACHE_SIZE", 1000)),
+            ttls={
+                "profile": float(os.getenv("CHESSCOM_PROFILE_TTL", 600)),
+                "stats": float(os.getenv("CHESSCOM_STATS_TTL", 120)),
+            },
+            store=self.store,
+            limiter=limiter(
+                rate=float(os.getenv("CHESSCOM_RATE", 10)),
+                burst=int(os.getenv("CHESSCOM_BURST", 10)),
+            ),
+            retry_budget=float(os.getenv("CHESSCOM_RETRY_BUDGET", 5)),
+            shared=SHARED_STORE,
+        )
+        # Discord user -> chess.com account
+        self.links = LinkRegistry(self.store, shared=SHARED_STORE)
+        # monthly game archives, walked into the store for /form, /colours and /trend
+        # PGN parsing and game aggregates, in worker processes
+        self.analyzer = Analyzer(
+            self.store.path, workers=int(os.getenv("ANALYSIS_WORKERS", 2))
+        )
+        # rendered /history charts, keyed by (player, mode, last game end time)
+        self.charts = ImageCache(int(os.getenv("CHART_CACHE_BYTES", 32 * 1024 * 1024)))
+        self.archives = ArchiveIngester(
+            self.chesscom,
+            self.store,
+            analyzer=self.analyzer,
+            refresh=float(os.getenv("ARCHIVE_REFRESH", 600)),
+            max_players=int(os.getenv("DATABASE_MAX_ARCHIVE_PLAYERS", 1000)),
+        )
+        # players the bot has seen, for username autocomplete
+        self.usernames = UsernameIndex()
+        # per guild rankings of linked members, kept sorted as stats come in
+        self.leaderboards = Leaderboards()
+        # keeps the ratings in /nick nicknames current
+        self.nick_sync = NicknameSync(
+            self,
+            period=float(os.getenv("NICK_SYNC_PERIOD", 3600)),
+            concurrency=int(os.getenv("NICK_SYNC_CONCURRENCY", 4)),
+            edits_per_second=float(os.getenv("NICK_SYNC_EDITS_PER_SECOND", 1)),
+        )
+        # tells followers when the players they follow come online or finish games
+        self.presence = PresenceTracker(
+            self,
+            min_interval=float(os.getenv("PRESENCE_MIN_INTERVAL", 60)),
+            max_interval=float(os.getenv("PRESENCE_MAX_INTERVAL", 3600)),
+            batch_size=int(os.getenv("PRESENCE_BATCH_SIZE", 20)),
+            max_follows=int(os.getenv("FOLLOW_LIMIT", 25)),
+        )
+        # warms the cache for likely lookups once the bot is ready
+        self.prefetcher = Prefetcher(
+            self,
+            top=int(os.getenv("PREFETCH_TOP", 200)),
+            concurrency=int(os.getenv("PREFETCH_CONCURRENCY", 2)),
+            window=float(os.getenv("COLD_START_WINDOW", 600)),
+        )
+        # local Prometheus endpoint, started in setup_hook
+        self.metrics_server = None
+        # seconds from launch to the first on_ready
+        self.ready_after = None
+
+    async def setup_hook(self):
+        await self.store.open()
+        await self.chesscom.start()
+        await self.links.load()
+        await self.load_usernames()
+        self.nick_sync.start()
+        await self.presence.load()
+        self.presence.start()
+        self.prefetcher.start()
+        self.start_metrics()
+        port = int(os.getenv("METRICS_PORT", 9108))
+        if port:
+            self.metrics_server = await metrics.serve(
+                os.getenv("METRICS_HOST", "127.0.0.1"), port
+            )
+        if SYNC_COMMANDS:
+            await self.sync_commands()
+        print(f"Setup done {time.monotonic() - LAUNCHED:.2f}s after launch")
+
+    async def sync_commands(self):
+        """
+        Sync the commands to GUILDS (and globally with SYNC_GLOBAL), skipping the
+        sync wherever they haven't changed since the last one. SYNC_FORCE=1 syncs
+        anyway, e.g. after the commands were changed by hand.
+        """
+        force = os.getenv("SYNC_FORCE", "0") == "1"
+        # This copies the global commands over to each guild, so they show up
+        # there right away instead of waiting for a global sync.
+        for guild in GUILDS:
+            self.tree.copy_global_to(guild=guild)
+        targets = GUILDS + ([None] if SYNC_GLOBAL else [])
+        started = time.monotonic()
+        synced = await asyncio.gather(
+            *(
+                sync_if_changed(self.tree, self.store, guild, force=force)
+                for guild in targets
+            )
+        )
+        for guild, changed in zip(targets, synced):
+            where = f"guild {guild.id}" if guild is not None else "global"
+            print(f"Commands {'synced' if changed else 'unchanged'} ({where})")
+        print(f"Command sync took {time.monotonic() - started:.2f}s")
+
+    async def load_usernames(self):
+        """
+        Seed autocomplete with the linked accounts and the players in the database
+        """
+        for username in await self.store.load_usernames():
+            self.usernames.record(username)
+        for link in self.links:
+            self.usernames.record(link.username, pinned=True)
+
+    def start_metrics(self):
+        metrics.watch(self.chesscom)
+        metrics.watch_nick_sync(self.nick_sync)
+        metrics.watch_presence(self.presence)
+        metrics.watch_prefetch(self.prefetcher)
+        spawn(metrics.monitor_loop_lag())
+
+    async def close(self):
+        if self.metrics_server is not None:
+            await self.metrics_server.cleanup()
+        await self.nick_sync.close()
+        await self.presence.close()
+        await self.prefetcher.close()
+        await self.chesscom.close()
+        await self.links.close()
+        await self.store.close()
+        self.analyzer.close()
+        await super().close()
+
+
+intents = discord.Intents.default()
+# member joins (for prefetching their linked account) need the privileged members
+# intent, enabled for the bot in the developer portal
+intents.members = os.getenv("MEMBERS_INTENT", "0") == "1"
+client = MyClient(intents=intents)
+
+
+@client.event
+async def on_app_command_completion(
+    interaction: discord.Interaction, command: app_commands.Command
+):
+    finish_command(interaction, "ok")
+
+
+@client.event
+async def on_ready():
+    print(f"Logged in as {client.user} (ID: {client.user.id})")
+    # on_ready fires again after reconnects, only the first one is startup
+    if client.ready_after is None:
+        client.ready_after = time.monotonic() - LAUNCHED
+        print(f"Ready {client.ready_after:.2f}s after launch")
+        client.prefetcher.warm_start()
+    print("------")
+
+
+@client.event
+async def on_member_join(member: discord.Member):
+    link = client.links.get(member.id)
+    if link is not None:
+        client.prefetcher.warm([link.username])
+
+
+@client.tree.command()
+async def ping(interaction: discord.Interaction):
+    """
+    Get the latency of the bot
+    """
+    cache = client.chesscom.cache.counters()
+    limiter = client.chesscom.limiter.counters()
+    # create embed
+    embed = discord.Embed(
+        title="Pong!",
+        description=f"Discord API latency: `{round(client.latency * 1000)}ms`\n"
+        f"chess.com cache: `{cache['hits']}` hits, `{cache['misses']}` misses, "
+        f"`{cache['revalidations']}` revalidated, `{cache['entries']}` entries, "
+        f"`{client.chesscom.coalesced}` coalesced, "
+        f"`{client.chesscom.stale_served}` served stale, "
+        f"`{client.chesscom.store_hits}` loaded from disk\n"
+        f"chess.com queue: `{limiter['queue_depth']}` waiting, "
+        f"`{limiter['wait_avg'] * 1000:.0f}ms` avg wait, "
+        f"`{limiter['wait_max'] * 1000:.0f}ms` max wait, "
+        f"`{limiter['throttled']}` throttled, `{client.chesscom.retries}` retries",
+        color=0x00FF00,
+    )
+    # send embed
+    await interaction.response.send_message(
+        embed=embed,
+        ephemeral=True,
+    )
+
+
+@client.tree.command(name="metrics")
+@app_commands.default_permissions(administrator=True)
+async def metrics_command(interaction: discord.Interaction):
+    """
+    Show a summary of the bot's performance metrics
+    """
+
+    def ms(seconds):
+        return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
+
+    # per-command latency, p50 and p95 are bucket upper bounds
+    commands = sorted({labels[0][1] for labels in metrics.command_seconds.values})
+    lines = []
+    for command in commands:
+        ok = metrics.commands_total.get(command, "ok")
+        errors = metrics.commands_total.get(command, "error")
+        lines.append(
+            f"`/{command}`: {ok + errors:.0f} runs, {errors:.0f} errors, "
+            f"p50 {ms(metrics.command_seconds.quantile(0.5, command))}, "
+            f"p95 {ms(metrics.command_seconds.quantile(0.95, command))}"
+        )
+
+    statuses = {}
+    for labels, count in metrics.upstream_responses.values.items():
+        status = labels[1][1]
+        statuses[status] = statuses.get(status, 0) + count
+    rejected = {}
+    for labels, count in metrics.admission_rejections.values.items():
+        reason = labels[1][1]
+        rejected[reason] = rejected.get(reason, 0) + count
+    cache = client.chesscom.cache.counters()
+    lookups = cache["hits"] + cache["misses"]
+    hit_ratio = cache["hits"] / lookups if lookups else 0
+
+    # create embed
+    embed = discord.Embed(title="Metrics", color=0x00FF00)
+    embed.add_field(name="Commands", value="\n".join(lines) or "None yet", inline=False)
+    embed.add_field(
+        name="chess.com",
+        value=f"Responses: {', '.join(f'`{s}` x{n:.0f}' for s, n in sorted(statuses.items())) or 'none'}\n"
+        f"Profile p95: {ms(metrics.upstream_seconds.quantile(0.95, 'profile'))}, "
+        f"stats p95: {ms(metrics.upstream_seconds.quantile(0.95, 'stats'))}\n"
+        f"In flight: `{metrics.upstream_in_flight.get():.0f}`, "
+        f"queued: `{client.chesscom.limiter.depth}`",
+        inline=False,
+    )
+    embed.add_field(
+        name="Bot",
+        value=f"Cache hit ratio: `{hit_ratio:.1%}`\n"
+        f"Commands in flight: `{metrics.commands_in_flight.get():.0f}`\n"
+        f"Rejected: {', '.join(f'{r} `{n:.0f}`' for r, n in sorted(rejected.items())) or 'none'}\n"
+        f"Event loop lag p99: {ms(metrics.loop_lag.quantile(0.99))}",
+        inline=False,
+    )
+    sync = client.nick_sync
+    outcomes = ("updated", "unchanged", "forbidden", "gone", "failed")
+    embed.add_field(
+        name="Nickname sync",
+        value=f"Cycle {sync.cycles + 1}: `{sync.done}/{sync.total}` links checked\n"
+        + ", ".join(
+            f"{outcome}: `{metrics.nick_sync_members.get(outcome):.0f}`"
+            for outcome in outcomes
+        ),
+        inline=False,
+    )
+    # send embed
+    await interaction.response.send_message(
+        embed=embed,
+        ephemeral=True,
+    )
+
+
+def requester(interaction: discord.Interaction):
+    """
+    Who to queue chess.com requests under, so guilds (or users in DMs) get a fair
+    share, and so do the users within a guild's share
+    """
+    if interaction.guild_id is not None:
+        return ("guild", interaction.guild_id, interaction.user.id)
+    return ("user", interaction.user.id)
+
+
+def error_reply(error: ChessComError) -> Reply:
+    """
+    The reply matching a chess.com API error
+    """
+    if isinstance(error, PlayerNotFound):
+        # create embed
+        embed = discord.Embed(
+            title="User not found",
+            description="The user you are looking for doesn't exist",
+            color=0xFF0000,
+        )
+        return Reply(embed)
+    if isinstance(error, RateLimited):
+        # create embed
+        embed = discord.Embed(
+            title="Rate limit exceeded",
+            description="Please try again later",
+            color=0xFF0000,
+        )
+    else:
+        # create embed
+        embed = discord.Embed(
+            title="An error occured",
+            description="Please try again later",
+            color=0xFF0000,
+        )
+    return Reply(embed, ephemeral=True)
+
+
+def rejected_reply(rejected) -> Reply:
+    """
+    The reply to a command turned away by admission control
+    """
+    if rejected.reason == "user":
+        description = (
+            f"You're using commands too quickly, try again in "
+            f"{max(1, round(rejected.retry_after))}s"
+        )
+    elif rejected.reason == "guild":
+        description = (
+            "Too many commands are running in this server, try again in a moment"
+        )
+    else:
+        description = "The bot is busy right now, try again in a moment"
+    # create embed
+    embed = discord.Embed(title="Slow down", description=description, color=0xFFA500)
+    return Reply(embed, ephemeral=True)
+
+
+def not_linked_reply() -> Reply:
+    # create embed
+    embed = discord.Embed(
+        title="No linked account",
+        description="Pass a username or link your chess.com account with `/link`",
+        color=0xFF0000,
+    )
+    return Reply(embed, ephemeral=True)
+
+
+def resolve_username(interaction: discord.Interaction, username: Optional[str]):
+    """
+    The given username, or the user's linked account if there is none
+    """
+    if username is not None:
+        return username
+    link = client.links.get(interaction.user.id)
+    return link.username if link is not None else None
+
+
+async def username_autocomplete(interaction: discord.Interaction, current: str):
+    """
+    Suggest players the bot has seen, most looked up first, from memory only
+    """
+    return [
+        app_commands.Choice(name=name, value=name)
+        for name in client.usernames.complete(current)
+    ]
+
+
+async def usernames_autocomplete(interaction: discord.Interaction, current: str):
+    """
+    Complete the last of several usernames, keeping the ones before it
+    """
+    given, _, last = current.replace(",", " ").rpartition(" ")
+    given = " ".join(given.split())
+    choices = []
+    for name in client.usernames.complete(last):
+        value = f"{given} {name}".strip()
+        # choice names and values are limited to 100 characters
+        if len(value) <= 100:
+            choices.append(app_commands.Choice(name=value, value=value))
+    return choices
+
+
+def seen(player: Player):
+    """
+    Remember a player that exists for autocomplete
+    """
+    client.usernames.record(player.username)
+    client.prefetcher.record(player.username)
+
+
+async def lookup(
+    interaction: discord.Interaction,
+    username: Optional[str],
+    render,
+    *,
+    max_stale: float = 0,
+):
+    """
+    Answer a lookup command with render(player), for the user's linked account if
+    no username is given.
+
+    A cached player that expired less than `max_stale` seconds ago is rendered
+    right away, and the message is edited once fresh data is in if it changed.
+    """
+    username = resolve_username(interaction, username)
+    if username is None:
+        return await send(interaction, not_linked_reply())
+
+    client.prefetcher.observe(username)
+    player = client.chesscom.cached_player(username, max_stale)
+    if player is not None and player.stale:
+        seen(player)
+        reply = render(player)
+        await send(interaction, reply)
+        spawn(refresh(interaction, username, render, reply))
+        return
+
+    async def work():
+        try:
+            player = await client.chesscom.fetch_player(
+                username, requester(interaction)
+            )
+        except ChessComError as e:
+            return error_reply(e)
+        seen(player)
+        return render(player)
+
+    await respond(
+        interaction, work(), expected=client.chesscom.expected_latency(username)
+    )
+
+
+async def refresh(interaction: discord.Interaction, username: str, render, sent: Reply):
+    """
+    Re-fetch a player shown from stale data and edit the message if anything changed
+    """
+    try:
+        player = await client.chesscom.fetch_player(username, requester(interaction))
+    except ChessComError:
+        # the stale answer stays up, it's better than an error
+        return
+    reply = render(player)
+    if reply.embed.to_dict() != sent.embed.to_dict():
+        try:
+            await interaction.edit_original_response(embed=reply.embed)
+        except discord.HTTPException:
+            # the message was deleted or the interaction token expired, the
+            # update has nowhere to go
+            pass
+
+
+async def build_nick(
+    interaction: discord.Interaction, username: Optional[str]
+) -> Reply:
+    """
+    Build the reply for /nick
+    """
+    if interaction.guild is None:
+        # create embed
+        embed = discord.Embed(
+            title="Nickname not changed",
+            description="Nicknames only exist in servers",
+            color=0xFF0000,
+        )
+        return Reply(embed, ephemeral=True)
+
+    link = client.links.get(interaction.user.id)
+    try:
+        if username is None and link is not None:
+            # the linked account already has the proper capitalisation, so the
+            # profile isn't needed
+            username = link.username
+            stats = await client.chesscom.fetch_stats(username, requester(interaction))
+        elif username is None:
+            return not_linked_reply()
+        else:
+            player = await client.chesscom.fetch_player(
+                username, requester(interaction)
+            )
+            username, stats = player.username, player.stats
+            seen(player)
+    except ChessComError as e:
+        return error_reply(e)
+
+    link = client.links.link(interaction.user.id, username, interaction.guild.id)
+    client.leaderboards.update(link, stats)
+    nick = nickname(username, stats)
+
+    # Update the users discord nickname
+    try:
+        await interaction.user.edit(nick=nick)
+        client.nick_sync.remember(interaction.guild.id, interaction.user.id, nick)
+        # create embed
+        embed = discord.Embed(
+            title="Nickname changed",
+            description=f"Your nickname has been changed to `{nick}`",
+            color=0x00FF00,
+        )
+        return Reply(embed, ephemeral=True)
+
+    except discord.Forbidden:
+        # create embed
+        embed = discord.Embed(
+            title="Nickname not changed",
+            description="I don't have permission to change your nickname",
+            color=0xFF0000,
+        )
+        return Reply(embed, ephemeral=True)
+
+
+async def build_link(interaction: discord.Interaction, username: str) -> Reply:
+    """
+    Build the reply for /link
+    """
+    try:
+        # the profile has the properly capitalised username
+        player = await client.chesscom.fetch_player(username, requester(interaction))
+    except ChessComError as e:
+        return error_reply(e)
+
+    client.usernames.record(player.username, pinned=True)
+    old = client.links.get(interaction.user.id)
+    if old is not None and old.username.lower() != player.username.lower():
+        # linking another account takes the old one off the leaderboards
+        client.leaderboards.remove(interaction.user.id)
+    # ranked on the leaderboard of the server it was run in
+    client.links.link(
+        interaction.user.id, player.username, interaction.guild_id, nick=False
+    )
+    # create embed
+    embed = discord.Embed(
+        title="Account linked",
+        description=f"Your account is now linked to `{player.username}`, "
+        "commands will use it when you leave out the username",
+        color=0x00FF00,
+    )
+    return Reply(embed, ephemeral=True)
+
+
+@client.tree.command()
+@app_commands.describe(
+    username="Your chess.com username (defaults to your linked account)"
+)
+@app_commands.autocomplete(username=username_autocomplete)
+async def nick(interaction: discord.Interaction, username: Optional[str] = None):
+    """
+    Change your nickname to your chess.com username with your rating
+    """
+    link = client.links.get(interaction.user.id)
+    await respond(
+        interaction,
+        build_nick(interaction, username),
+        expected=client.chesscom.expected_latency(
+            username or (link.username if link else "")
+        ),
+        ephemeral=True,
+    )
+
+
+@client.tree.command()
+@app_commands.describe(username="Your chess.com username")
+@app_commands.autocomplete(username=username_autocomplete)
+async def link(interaction: discord.Interaction, username: str):
+    """
+    Link your chess.com account so you can leave out your username
+    """
+    await respond(
+        interaction,
+        build_link(interaction, username),
+        expected=client.chesscom.expected_latency(username),
+        ephemeral=True,
+    )
+
+
+@client.tree.command()
+async def unlink(interaction: discord.Interaction):
+    """
+    Unlink your chess.com account
+    """
+    link = client.links.unlink(interaction.user.id)
+    client.leaderboards.remove(interaction.user.id)
+    if link is None:
+        # create embed
+        embed = discord.Embed(
+            title="No linked account",
+            description="Your account isn't linked",
+            color=0xFF0000,
+        )
+    else:
+        # create embed
+        embed = discord.Embed(
+            title="Account unlinked",
+            description=f"Your account is no longer linked to `{link.username}`",
+            color=0x00FF00,
+        )
+    # send embed
+    await interaction.response.send_message(
+        embed=embed,
+        ephemeral=True,
+    )
+
+
+async def build_follow(interaction: discord.Interaction, username: str) -> Reply:
+    """
+    Build the reply for /follow
+    """
+    try:
+        player = await client.chesscom.fetch_player(username, requester(interaction))
+    except ChessComError as e:
+        return error_reply(e)
+
+    seen(player)
+    followed = await client.presence.follow(
+        interaction.user.id,
+        player.username,
+        interaction.guild_id,
+        interaction.channel_id,
+    )
+    if not followed:
+        # create embed
+        embed = discord.Embed(
+            title="Too many players followed",
+            description=f"You can follow up to {client.presence.max_follows} players, "
+            "unfollow one first",
+            color=0xFF0000,
+        )
+        return Reply(embed, ephemeral=True)
+    # create embed
+    embed = discord.Embed(
+        title="Player followed",
+        description=f"You'll be told here when `{player.username}` comes online "
+        "or finishes a game",
+        color=0x00FF00,
+    )
+    return Reply(embed, ephemeral=True)
+
+
+@client.tree.command(name="import")
+@app_commands.describe(
+    members="A CSV file of Discord id,chess.com username lines, one per member"
+)
+@app_commands.default_permissions(administrator=True)
+@app_commands.guild_only()
+async def import_command(interaction: discord.Interaction, members: discord.Attachment):
+    """
+    Link many members to their chess.com accounts at once and set their nicknames
+    """
+    if members.size > IMPORT_MAX_BYTES:
+        # create embed
+        embed = discord.Embed(
+            title="File too large",
+            description=f"The CSV can be at most {IMPORT_MAX_BYTES // 1024} KB",
+            color=0xFF0000,
+        )
+        return await send(interaction, Reply(embed, ephemeral=True))
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    rows, errors = parse_csv(
+        await members.read(), max_rows=int(os.getenv("IMPORT_MAX_ROWS", 1000))
+    )
+    job = BulkImport(
+        client,
+        interaction.guild,
+        rows,
+        concurrency=int(os.getenv("IMPORT_CONCURRENCY", 8)),
+    )
+    started = time.monotonic()
+    task = asyncio.ensure_future(job.run())
+    # progress edits every few seconds, well under the webhook edit rate limit,
+    # for as long as the interaction token is valid
+    handed_over = False
+    while not task.done():
+        await asyncio.wait({task}, timeout=IMPORT_PROGRESS_INTERVAL)
+        if task.done() or handed_over:
+            continue
+        embed = render_import(job, errors).embed
+        if time.monotonic() - started > IMPORT_TOKEN_WINDOW:
+            # nickname edits are paced, a big import outlasts the token
+            embed.set_footer(text="The report will be posted in this channel")
+            handed_over = True
+        try:
+            await interaction.edit_original_response(embed=embed)
+        except discord.HTTPException:
+            # a missed progress update isn't worth stopping the import for
+            pass
+    await task
+
+    report = render_import(job, errors).embed
+    if not handed_over:
+        try:
+            return await interaction.edit_original_response(embed=report)
+        except discord.HTTPException:
+            pass
+    await interaction.channel.send(
+        f"{interaction.user.mention} your import finished",
+        embed=report,
+        allowed_mentions=discord.AllowedMentions(users=[interaction.user]),
+    )
+
+
+@client.tree.command()
+@app_commands.describe(username="The chess.com username of the player to follow")
+@app_commands.autocomplete(username=username_autocomplete)
+async def follow(interaction: discord.Interaction, username: str):
+    """
+    Get notified in this channel when a player comes online or finishes a game
+    """
+    await respond(
+        interaction,
+        build_follow(interaction, username),
+        expected=client.chesscom.expected_latency(username),
+        ephemeral=True,
+    )
+
+
+async def followed_autocomplete(interaction: discord.Interaction, current: str):
+    """
+    Suggest the players the user follows
+    """
+    current = current.strip().lower()
+    return [
+        app_commands.Choice(name=follow.username, value=follow.username)
+        for follow in client.presence.following(interaction.user.id)
+        if follow.username.startswith(current)
+    ][:25]
+
+
+@client.tree.command()
+@app_commands.describe(username="The chess.com username of the player to unfollow")
+@app_commands.autocomplete(username=followed_autocomplete)
+async def unfollow(interaction: discord.Interaction, username: str):
+    """
+    Stop getting notified about a player
+    """
+    follow = await client.presence.unfollow(interaction.user.id, username)
+    if follow is None:
+        # create embed
+        embed = discord.Embed(
+            title="Not following",
+            description=f"You don't follow `{username}`",
+            color=0xFF0000,
+        )
+    else:
+        # create embed
+        embed = discord.Embed(
+            title="Player unfollowed",
+            description=f"You no longer follow `{follow.username}`",
+            color=0x00FF00,
+        )
+    # send embed
+    await interaction.response.send_message(
+        embed=embed,
+        ephemeral=True,
+    )
+
+
+@client.tree.command()
+async def following(interaction: discord.Interaction):
+    """
+    List the players you follow
+    """
+    follows = client.presence.following(interaction.user.id)
+    # create embed
+    embed = discord.Embed(
+        title="Followed players",
+        description="\n".join(
+            f"`{follow.username}` in <#{follow.channel_id}>" for follow in follows
+        )
+        or "You don't follow anyone, use /follow",
+        color=0x00FF00,
+    )
+    # send embed
+    await interaction.response.send_message(
+        embed=embed,
+        ephemeral=True,
+    )
+
+
+@client.tree.command()
+@app_commands.describe(
+    username="The username of the user you want to get the stats from (defaults to your linked account)"
+)
+@app_commands.autocomplete(username=username_autocomplete)
+async def chess(interaction: discord.Interaction, username: Optional[str] = None):
+    """
+    Get the general stats of a user
+    """
+    await lookup(interaction, username, render_overview, max_stale=max_stale("chess"))
+
+
+@client.tree.command()
+@app_commands.describe(
+    username="The username of the user you want to get the stats from (defaults to your linked account)"
+)
+@app_commands.autocomplete(username=username_autocomplete)
+async def puzzle(interaction: discord.Interaction, username: Optional[str] = None):
+    """
+    Get the puzzle stats of a user
+    """
+    await lookup(interaction, username, render_puzzle, max_stale=max_stale("puzzle"))
+
+
+# most usernames /compare takes at once
+COMPARE_MAX = 8
+
+
+@client.tree.command()
+@app_commands.describe(
+    usernames="Up to 8 chess.com usernames separated by spaces or commas"
+)
+@app_commands.autocomplete(usernames=usernames_autocomplete)
+async def compare(interaction: discord.Interaction, usernames: str):
+    """
+    Compare the ratings of several users
+    """
+    # drop duplicates but keep the order they were given in
+    names = list(dict.fromkeys(usernames.lower().replace(",", " ").split()))
+    names = names[:COMPARE_MAX]
+    if len(names) < 2:
+        # create embed
+        embed = discord.Embed(
+            title="Not enough users",
+            description="Give at least two usernames to compare",
+            color=0xFF0000,
+        )
+        return await send(interaction, Reply(embed, ephemeral=True))
+
+    async def work():
+        results = await client.chesscom.fetch_many(names, requester(interaction))
+        for player in results.values():
+            if isinstance(player, Player):
+                seen(player)
+        return render_compare(results)
+
+    await respond(
+        interaction,
+        work(),
+        expected=max(client.chesscom.expected_latency(name) for name in names),
+    )
+
+
+async def build_leaderboard(
+    interaction: discord.Interaction, mode: TimeControl
+) -> Reply:
+    """
+    Build the reply for /leaderboard
+    """
+    # members already on the boards are kept current by the nickname sync, only
+    # the ones never loaded are fetched here
+    links = client.links.in_guild(interaction.guild_id)
+    missing = [
+        link
+        for link in links
+        if not client.leaderboards.has(interaction.guild_id, link.user_id)
+    ]
+    results = await client.chesscom.fetch_many(
+        [link.username for link in missing], requester(interaction), stats_only=True
+    )
+    failed = 0
+    for link in missing:
+        stats = results[link.username]
+        if isinstance(stats, ChessComError):
+            failed += 1
+        else:
+            client.leaderboards.update(link, stats)
+    board = client.leaderboards.board(interaction.guild_id, mode.name)
+    return render_leaderboard(board, mode, failed=failed)
+
+
+@client.tree.command()
+@app_commands.describe(mode="The time control to rank by")
+@app_commands.choices(
+    mode=[
+        app_commands.Choice(name=mode.label, value=mode.name)
+        for mode in TIME_CONTROLS.values()
+    ]
+)
+@app_commands.guild_only()
+async def leaderboard(interaction: discord.Interaction, mode: str):
+    """
+    Rank the linked members of this server
+    """
+    links = client.links.in_guild(interaction.guild_id)
+    expected = max(
+        (
+            client.chesscom.expected_latency(link.username)
+            for link in links
+            if not client.leaderboards.has(interaction.guild_id, link.user_id)
+        ),
+        default=0,
+    )
+    await respond(
+        interaction,
+        build_leaderboard(interaction, TIME_CONTROLS[mode]),
+        expected=expected,
+    )
+
+
+# months of archives /colours and /trend look at, /form only needs the latest two
+HISTORY_MONTHS = int(os.getenv("ARCHIVE_MONTHS", 12))
+
+# the time controls games can be filtered by, daily960 is a variant of daily
+GAME_MODES = [mode for mode in TIME_CONTROLS.values() if mode.key.startswith("chess_")]
+game_mode_choices = app_commands.choices(
+    mode=[app_commands.Choice(name=mode.label, value=mode.name) for mode in GAME_MODES]
+)
+
+
+async def games_command(
+    interaction: discord.Interaction, username: Optional[str], months: int, build
+):
+    """
+    Answer a command built from a player's archived games: ingest the latest
+    `months` archives, then `build(username)` the reply from the store
+    """
+    username = resolve_username(interaction, username)
+    if username is None:
+        return await send(interaction, not_linked_reply())
+
+    async def work():
+        try:
+            await client.archives.ingest(
+                username, requester(interaction), months=months
+            )
+        except ChessComError as e:
+            return error_reply(e)
+        return await build(normalise(username))
+
+    # the archive list is always fetched, and maybe a few months
+    await respond(
+        interaction,
+        work(),
+        expected=client.chesscom.latency + client.chesscom.limiter.expected_wait(),
+    )
+
+
+@client.tree.command()
+@app_commands.describe(
+    username="The username of the user you want to get the form of (defaults to your linked account)",
+    mode="Only count games in this time control",
+)
+@game_mode_choices
+@app_commands.autocomplete(username=username_autocomplete)
+async def form(
+    interaction: discord.Interaction,
+    username: Optional[str] = None,
+    mode: Optional[str] = None,
+):
+    """
+    Get the results of a user's last 10 games
+    """
+
+    async def build(name):
+        rows = await client.store.load_games(name, time_class=mode, limit=10)
+        label = TIME_CONTROLS[mode].label if mode else None
+        return render_form(username or name, [Game.from_row(r) for r in rows], label)
+
+    await games_command(interaction, username, 2, build)
+
+
+@client.tree.command()
+@app_commands.describe(
+    username="The username of the user you want to get the results from (defaults to your linked account)",
+    mode="Only count games in this time control",
+)
+@game_mode_choices
+@app_commands.autocomplete(username=username_autocomplete)
+async def colours(
+    interaction: discord.Interaction,
+    username: Optional[str] = None,
+    mode: Optional[str] = None,
+):
+    """
+    Get the win rate of a user with white and with black
+    """
+
+    async def build(name):
+        rows = await client.store.load_colour_results(name, time_class=mode)
+        label = TIME_CONTROLS[mode].label if mode else None
+        return render_colours(username or name, rows, label)
+
+    await games_command(interaction, username, HISTORY_MONTHS, build)
+
+
+@client.tree.command()
+@app_commands.describe(
+    username="The username of the user you want to get the results from (defaults to your linked account)",
+    mode="Only count games in this time control, also shows the rating",
+)
+@game_mode_choices
+@app_commands.autocomplete(username=username_autocomplete)
+async def trend(
+    interaction: discord.Interaction,
+    username: Optional[str] = None,
+    mode: Optional[str] = None,
+):
+    """
+    Get the results of a user month by month
+    """
+
+    async def build(name):
+        rows = await client.store.load_monthly_results(
+            name, time_class=mode, months=HISTORY_MONTHS
+        )
+        label = TIME_CONTROLS[mode].label if mode else None
+        return render_trend(
+            username or name, rows, label, client.archives.ingested(name)
+        )
+
+    await games_command(interaction, username, HISTORY_MONTHS, build)
+
+
+@client.tree.command()
+@app_commands.describe(
+    username="The username of the user you want to get the openings of (defaults to your linked account)",
+    mode="Only count games in this time control",
+)
+@game_mode_choices
+@app_commands.autocomplete(username=username_autocomplete)
+async def openings(
+    interaction: discord.Interaction,
+    username: Optional[str] = None,
+    mode: Optional[str] = None,
+):
+    """
+    Get the openings a user plays most
+    """
+
+    async def build(name):
+        rows = await client.analyzer.analyse(name, analysis.openings, mode)
+        label = TIME_CONTROLS[mode].label if mode else None
+        return render_openings(username or name, rows, label)
+
+    await games_command(interaction, username, HISTORY_MONTHS, build)
+
+
+@client.tree.command()
+@app_commands.describe(
+    username="The username of the user you want to get the breakdown of (defaults to your linked account)"
+)
+@app_commands.autocomplete(username=username_autocomplete)
+async def breakdown(interaction: discord.Interaction, username: Optional[str] = None):
+    """
+    Get a user's results and average game length per time control
+    """
+
+    async def build(name):
+        rows = await client.analyzer.analyse(name, analysis.breakdown)
+        return render_breakdown(username or name, rows)
+
+    await games_command(interaction, username, HISTORY_MONTHS, build)
+
+
+@client.tree.command()
+@app_commands.describe(
+    opponent="The chess.com username of the opponent",
+    username="The username of the user (defaults to your linked account)",
+)
+@app_commands.autocomplete(
+    opponent=username_autocomplete, username=username_autocomplete
+)
+async def h2h(
+    interaction: discord.Interaction, opponent: str, username: Optional[str] = None
+):
+    """
+    Get a user's results against one opponent
+    """
+
+    async def build(name):
+        result = await client.analyzer.analyse(name, analysis.head_to_head, opponent)
+        return render_head_to_head(username or name, opponent, result)
+
+    await games_command(interaction, username, HISTORY_MONTHS, build)
+
+
+@client.tree.command()
+@app_commands.describe(
+    mode="The time control to plot",
+    username="The username of the user you want the rating history of (defaults to your linked account)",
+)
+@game_mode_choices
+@app_commands.autocomplete(username=username_autocomplete)
+async def history(
+    interaction: discord.Interaction, mode: str, username: Optional[str] = None
+):
+    """
+    Get a chart of a user's rating over time
+    """
+    if not charts.available():
+        return await send(interaction, charts_unavailable())
+    label = TIME_CONTROLS[mode].label
+
+    async def build(name):
+        last = await client.analyzer.analyse(name, charts.last_game, mode)
+        if last is None:
+            return not_found_games(username or name, f"{label.lower()} games")
+        # a new game changes the key, so a cached chart is never out of date
+        key = (name, mode, last)
+        image = client.charts.get(key)
+        if image is None:
+            title = f"{username or name} {label.lower()} rating"
+            image = await client.analyzer.analyse(
+                name, charts.rating_history, mode, title
+            )
+            client.charts.put(key, image)
+        return render_history(username or name, label, image)
+
+    await games_command(interaction, username, HISTORY_MONTHS, build)
+
+
+def mode_command(mode: TimeControl) -> app_commands.Command:
+    """
+    Build the slash command for a time control, e.g. /rapid
+    """
+
+    async def callback(
+        interaction: discord.Interaction, username: Optional[str] = None
+    ):
+        await lookup(
+            interaction,
+            username,
+            lambda player: render_mode(player, mode),
+            max_stale=max_stale(mode.name),
+        )
+
+    command = app_commands.Command(
+        name=mode.name,
+        description=f"Get the {mode.label.lower()} stats of a user",
+        callback=callback,
+    )
+    command = app_commands.autocomplete(username=username_autocomplete)(command)
+    return app_commands.describe(
+        username="The username of the user you want to get the stats from (defaults to your linked account)"
+    )(command)
+
+
+for mode in TIME_CONTROLS.values():
+    client.tree.add_command(mode_command(mode))
@@ -0,0 +1,189 @@
+import asyncio
+import csv
+import io
+import re
+
+import discord
+
+from chesscom import ChessComError, PlayerNotFound, normalise
+from render import nickname
+
+# what chess.com allows in a username
+USERNAME = re.compile(r"^[A-Za-z0-9_-]{3,25}$")
+# a Discord id, bare or as a mention
+USER_ID = re.compile(r"^<?@?!?(\d{15,20})>?$")
+
+
+def parse_csv(data: bytes, *, max_rows: int = 1000):
+    """
+    Parse `discord id,chess.com username` lines into `(rows, errors)`: the rows as
+    `(user_id, username)` and the lines that couldn't be used as `(line, reason)`.
+    A header line is skipped, a user listed twice keeps the last username.
+    """
+    text = data.decode("utf-8-sig", errors="replace")
+    rows = {}
+    errors = []
+    for line, cells in enumerate(csv.reader(io.StringIO(text)), 1):
+        cells = [cell.strip() for cell in cells]
+        if not any(cells):
+            continue
+        if len(cells) < 2:
+            errors.append((line, "expected a Discord id and a username"))
+            continue
+        user_id = USER_ID.match(cells[0])
+        if user_id is None:
+            if line != 1:
+                errors.append((line, f"`{cells[0]}` isn't a Discord id"))
+            continue
+        if not USERNAME.match(cells[1]):
+            errors.append((line, f"`{cells[1]}` isn't a chess.com username"))
+            continue
+        user_id = int(user_id.group(1))
+        if user_id in rows:
+            errors.append((line, f"<@{user_id}> is listed again, using this line"))
+        elif len(rows) >= max_rows:
+            errors.append((line, f"only {max_rows} members can be imported at once"))
+            break
+        rows[user_id] = cells[1]
+    return list(rows.items()), errors
+
+
+class BulkImport:
+    """
+    Links a list of members to chess.com accounts in one guild and sets their
+    rating nicknames.
+
+    Rows are validated `concurrency` at a time: the user has to be a member of
+    the guild and not linked to a different account already (an import doesn't
+    get to change someone's identity in other servers), and the username is
+    looked up, queued under the guild in the rate limiter like its commands.
+    Nicknames are then set `batch_size` members at a time through the nickname
+    sync, which paces the edits. `done` and `total` track the current phase for
+    progress reports.
+    """
+
+    def __init__(
+        self,
+        client: discord.Client,
+        guild: discord.Guild,
+        rows: list,
+        *,
+        concurrency: int = 8,
+        batch_size: int = 25,
+    ):
+        self.client = client
+        self.guild = guild
+        self.rows = rows
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.phase = "Validating usernames"
+        self.done = 0
+        self.total = len(rows)
+        # user id -> Player of the usernames that exist
+        self.players = {}
+        # (user id, given username, current username) of accounts that were renamed
+        self.renamed = []
+        # (user id, username, reason) of the usernames that can't be linked
+        self.invalid = []
+        # nickname sync outcome -> members
+        self.nicks = {}
+
+    async def run(self):
+        await self.validate()
+        self.link()
+        await self.apply_nicknames()
+        self.phase = "Done"
+
+    async def validate(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def check(user_id: int, username: str):
+            async with semaphore:
+                try:
+                    reason = await self.check_member(user_id)
+                    if reason is not None:
+                        self.invalid.append((user_id, username, reason))
+                        return
+                    player = await self.client.chesscom.fetch_player(
+                        username, ("guild", self.guild.id)
+                    )
+                except PlayerNotFound:
+                    self.invalid.append((user_id, username, "not found"))
+                except ChessComError:
+                    self.invalid.append((user_id, username, "chess.com error"))
+                else:
+                    # a renamed account redirects (301) to its new name, the
+                    # profile has the name it ended up at, which an existing
+                    # link may use already
+                    reason = self.linked_elsewhere(user_id, player.username)
+                    if reason is not None:
+                        self.invalid.append((user_id, username, reason))
+                        return
+                    if normalise(player.username) != normalise(username):
+                        self.renamed.append((user_id, username, player.username))
+                    self.players[user_id] = player
+                finally:
+                    self.done += 1
+
+        await asyncio.gather(*(check(user_id, name) for user_id, name in self.rows))
+
+    async def check_member(self, user_id: int):
+        """
+        Why a user can't be linked by this import, None if they're a member
+        """
+        if self.guild.get_member(user_id) is None:
+            try:
+                await self.guild.fetch_member(user_id)
+            except discord.NotFound:
+                return "not a member of this server"
+            except discord.HTTPException:
+                return "couldn't look up the member"
+        return None
+
+    def linked_elsewhere(self, user_id: int, username: str):
+        """
+        Why a user can't be linked to `username`, if they already are to another account
+        """
+        link = self.client.links.get(user_id)
+        if link is not None and normalise(link.username) != normalise(username):
+            return f"already linked to {link.username}"
+        return None
+
+    def link(self):
+        for user_id, player in list(self.players.items()):
+            # checked again, the user may have run /link during the import
+            reason = self.linked_elsewhere(user_id, player.username)
+            if reason is not None:
+                del self.players[user_id]
+                self.invalid.append((user_id, player.username, reason))
+                continue
+            self.client.usernames.record(player.username, pinned=True)
+            link = self.client.links.link(user_id, player.username, self.guild.id)
+            self.client.leaderboards.update(link, player.stats)
+
+    async def apply_nicknames(self):
+        self.phase = "Setting nicknames"
+        self.done = 0
+        self.total = len(self.players)
+        sync = self.client.nick_sync
+        players = list(self.players.items())
+        for start in range(0, len(players), self.batch_size):
+            batch = []
+            for user_id, player in players[start : start + self.batch_size]:
+                link = self.client.links.get(user_id)
+                if link is None:
+                    # unlinked during the import
+                    self.nicks["unlinked"] = self.nicks.get("unlinked", 0) + 1
+                else:
+                    batch.append((link, player))
+            outcomes = await asyncio.gather(
+                *(
+                    sync.sync_member(
+                        link, self.guild.id, nickname(player.username, player.stats)
+                    )
+                    for link, player in batch
+                )
+            )
+            for outcome in outcomes:
+                self.nicks[outcome] = self.nicks.get(outcome, 0) + 1
+            self.done += min(self.batch_size, len(players) - start)
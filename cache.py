@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+
+
+class CacheEntry:
+    """
+    A cached response body with the validators needed to revalidate it
+    """
+
+    __slots__ = ("value", "etag", "last_modified", "expires_at")
+
+    def __init__(self, value, expires_at: float, etag=None, last_modified=None):
+        self.value = value
+        self.expires_at = expires_at
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache of chess.com responses with per-entry TTLs
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Return the entry for key if it is still fresh, counting a hit or miss
+        """
+        entry = self.entries.get(key)
+        if entry is None or not entry.fresh:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def get_stale(self, key):
+        """
+        Return the entry for key even if it has expired, e.g. to revalidate it
+        """
+        return self.entries.get(key)
+
+    def put(self, key, value, ttl: float, etag=None, last_modified=None):
+        entry = CacheEntry(value, time.monotonic() + ttl, etag, last_modified)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def refresh(self, key, ttl: float):
+        """
+        Extend an entry after the server confirmed it is unchanged (304)
+        """
+        entry = self.entries[key]
+        entry.expires_at = time.monotonic() + ttl
+        self.entries.move_to_end(key)
+        self.revalidations += 1
+        return entry
+
+    def counters(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,98 @@
+import importlib.util
+import io
+from collections import OrderedDict
+from datetime import datetime
+from itertools import compress
+
+from analysis import TIME_CLASSES, GameColumns
+
+# matplotlib is optional, without it /history says charts aren't available. Only
+# the workers import it, importing it takes seconds the bot doesn't need to spend.
+MATPLOTLIB = importlib.util.find_spec("matplotlib") is not None
+
+
+def available() -> bool:
+    return MATPLOTLIB
+
+
+def last_game(columns: GameColumns, time_class: str):
+    """
+    End time of the newest game in a time class, None if there is none. The
+    columns are in end time order.
+    """
+    index = TIME_CLASSES.index(time_class)
+    for position in range(len(columns) - 1, -1, -1):
+        if columns.time_class[position] == index:
+            return columns.end_time[position]
+    return None
+
+
+def rating_history(columns: GameColumns, time_class: str, title: str) -> bytes:
+    """
+    Plot the rating after every game in a time class to a PNG, in a worker process
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib import pyplot
+    from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+
+    mask = columns.mask(time_class)
+    points = [
+        (datetime.fromtimestamp(end_time), rating)
+        for end_time, rating in zip(
+            compress(columns.end_time, mask), compress(columns.rating, mask)
+        )
+        if rating
+    ]
+    figure, axes = pyplot.subplots(figsize=(8, 4), dpi=100)
+    try:
+        if points:
+            dates, ratings = zip(*points)
+            axes.plot(dates, ratings, color="#81b64c", linewidth=1.5)
+            locator = AutoDateLocator()
+            axes.xaxis.set_major_locator(locator)
+            axes.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+        axes.set_title(title)
+        axes.set_ylabel("Rating")
+        axes.grid(alpha=0.3)
+        figure.tight_layout()
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format="png")
+        return buffer.getvalue()
+    finally:
+        pyplot.close(figure)
+
+
+class ImageCache:
+    """
+    LRU of rendered images bounded by their total size in bytes
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        image = self.entries.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key, image: bytes):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        if len(image) > self.max_bytes:
+            return
+        self.entries[key] = image
+        self.size += len(image)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
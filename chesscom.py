@@ -0,0 +1,530 @@
+import asyncio
+import os
+import random
+import time
+
+import aiohttp
+
+import metrics
+from background import spawn
+from cache import ResponseCache
+from models import PlayerProfile, PlayerStats
+from ratelimit import RateLimiter, Ticket
+
+
+class ChessComError(Exception):
+    """
+    Base class for errors returned by the chess.com API
+    """
+
+
+class PlayerNotFound(ChessComError):
+    """
+    The player doesn't exist (404), e.g. the account was closed
+    """
+
+
+class RateLimited(ChessComError):
+    """
+    chess.com answered with 429 Too Many Requests
+    """
+
+    def __init__(self, path=None, retry_after=None):
+        super().__init__(path)
+        self.retry_after = retry_after
+
+
+class UpstreamError(ChessComError):
+    """
+    Any other non-200 answer, timeout or connection error
+    """
+
+    def __init__(self, status=None):
+        super().__init__(f"chess.com returned {status}")
+        self.status = status
+
+
+class Player:
+    """
+    Profile and stats of a single chess.com player
+    """
+
+    __slots__ = ("profile", "stats", "stale")
+
+    def __init__(
+        self, profile: PlayerProfile, stats: PlayerStats, *, stale: bool = False
+    ):
+        self.profile = profile
+        self.stats = stats
+        # served from cache entries past their TTL
+        self.stale = stale
+
+    @property
+    def username(self) -> str:
+        return self.profile.username
+
+
+# paths of the endpoints the bot uses, relative to the API root
+ENDPOINTS = {
+    "profile": "/player/{username}",
+    "stats": "/player/{username}/stats",
+}
+
+# what each endpoint's response is parsed into before it's cached
+MODELS = {
+    "profile": PlayerProfile,
+    "stats": PlayerStats,
+}
+
+
+def backoff(attempt: int, base: float = 0.5, cap: float = 8) -> float:
+    """
+    Exponential backoff with full jitter, so retrying clients don't stay in lockstep
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def parse_retry_after(headers) -> float:
+    """
+    Seconds to wait from a Retry-After header, or None if it's missing or an HTTP date
+    """
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+
+def normalise(username: str) -> str:
+    """
+    chess.com usernames are case-insensitive, so lookups are keyed by the lowercase name
+    """
+    return username.strip().lower()
+
+
+class ChessComClient:
+    """
+    Long-lived, pooled HTTP client for the chess.com public API
+    """
+
+    def __init__(
+        self,
+        *,
+        base_url: str = "https://api.chess.com/pub",
+        pool_size: int = 20,
+        keepalive: float = 30,
+        dns_ttl: int = 300,
+        timeout: float = 10,
+        cache_size: int = 1000,
+        ttls: dict = None,
+        store=None,
+        limiter=None,
+        retry_budget: float = 5,
+        shared: bool = False,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.dns_ttl = dns_ttl
+        self.timeout = timeout
+        # seconds a response is served from the cache before it is revalidated
+        self.ttls = {"profile": 600, "stats": 120}
+        self.ttls.update(ttls or {})
+        self.cache = ResponseCache(cache_size)
+        # optional persistent Store the cache is written through to
+        self.store = store
+        self.store_hits = 0
+        # other processes (shards) use the same store: check it before fetching
+        # even with a memory entry, and take a lease so only one of them fetches
+        self.shared = shared
+        self.owner = str(os.getpid())
+        # write-throughs still running, waited for on close
+        self.background = set()
+        # requests currently on the wire, keyed like the cache, the rate limiter
+        # tickets they wait for tokens with, and how many lookups piggybacked on
+        # one of them instead of sending their own
+        self.inflight = {}
+        self.tickets = {}
+        self.coalesced = 0
+        self.stale_served = 0
+        # every request waits for a token, and failed ones are retried with
+        # jittered exponential backoff for at most retry_budget seconds
+        self.limiter = limiter or RateLimiter()
+        self.retry_budget = retry_budget
+        self.retries = 0
+        # moving average of how long one profile or stats request takes, used to
+        # predict slow commands
+        self.latency = 0.5
+        self.session = None
+
+    async def start(self):
+        # one connector for the lifetime of the bot, so connections (and their
+        # TLS sessions) get reused between commands instead of re-handshaking
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            limit_per_host=self.pool_size,
+            keepalive_timeout=self.keepalive,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_ttl,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"Accept": "application/json"},
+        )
+
+    async def close(self):
+        # let pending write-throughs land before the store closes
+        if self.background:
+            await asyncio.gather(*self.background, return_exceptions=True)
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def get(self, path: str, headers: dict = None, timeout=None):
+        """
+        Start a GET request for a path relative to the API root, e.g. `/player/hikaru`
+        """
+        # without a timeout of its own the session's applies
+        extra = {"timeout": timeout} if timeout is not None else {}
+        return self.session.get(f"{self.base_url}{path}", headers=headers, **extra)
+
+    async def request(
+        self,
+        path: str,
+        headers: dict = None,
+        requester=None,
+        endpoint: str = "other",
+        read=None,
+    ):
+        """
+        GET a path through the rate limiter and return `(status, headers, body)`,
+        raising a ChessComError for anything but 200 or 304. The body is None for a 304.
+        Rate limits and server errors are retried while the retry budget allows.
+        `read(response)` can replace decoding the body as JSON, e.g. to stream it.
+        A streamed body can take much longer than the session's total timeout, so
+        only connecting and each read are timed out then.
+        """
+        deadline = time.monotonic() + self.retry_budget
+        attempt = 0
+        while True:
+            await self.limiter.acquire(requester)
+            try:
+                return await self._request_once(path, headers, endpoint, read)
+            except RateLimited as e:
+                delay = e.retry_after or backoff(attempt)
+                self.limiter.pause(delay)
+                error = e
+            except UpstreamError as e:
+                if e.status is not None and e.status < 500:
+                    raise
+                delay = backoff(attempt)
+                error = e
+            if time.monotonic() + delay > deadline:
+                raise error
+            self.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _request_once(self, path: str, headers: dict, endpoint: str, read=None):
+        started = time.monotonic()
+        status = 0
+        timeout = None
+        if read is not None:
+            timeout = aiohttp.ClientTimeout(
+                sock_connect=self.timeout, sock_read=self.timeout
+            )
+        metrics.upstream_in_flight.inc()
+        try:
+            async with self.get(path, headers, timeout) as resp:
+                status = resp.status
+                # a renamed account's 301 is followed to its new name, so only
+                # a 404 means there's no such player
+                if resp.status == 404:
+                    raise PlayerNotFound(path)
+                if resp.status == 429:
+                    raise RateLimited(path, parse_retry_after(resp.headers))
+                if resp.status == 304:
+                    return resp.status, resp.headers, None
+                if resp.status != 200:
+                    raise UpstreamError(resp.status)
+                body = await (read(resp) if read else resp.json())
+                return resp.status, resp.headers, body
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise UpstreamError() from e
+        finally:
+            elapsed = time.monotonic() - started
+            # archive downloads take seconds, they'd make every command look slow
+            if endpoint in ENDPOINTS:
+                self.latency = 0.8 * self.latency + 0.2 * elapsed
+            metrics.upstream_in_flight.dec()
+            metrics.upstream_seconds.observe(elapsed, endpoint)
+            metrics.upstream_responses.inc(endpoint, status)
+
+    def is_cached(self, username: str) -> bool:
+        """
+        Whether fetch_player can be answered from memory without any I/O
+        """
+        username = normalise(username)
+        for endpoint in ENDPOINTS:
+            entry = self.cache.get_stale((endpoint, username))
+            if entry is None or not entry.fresh:
+                return False
+        return True
+
+    def is_fetching(self, username: str) -> bool:
+        """
+        Whether a request for the player is already in flight
+        """
+        username = normalise(username)
+        return any((endpoint, username) in self.inflight for endpoint in ENDPOINTS)
+
+    def cached_player(self, username: str, max_stale: float = 0):
+        """
+        The player from memory if both endpoints expired at most `max_stale` seconds
+        ago, otherwise None. Never does any I/O.
+        """
+        username = normalise(username)
+        entries = [self.cache.get_stale((endpoint, username)) for endpoint in ENDPOINTS]
+        if None in entries:
+            return None
+        now = time.monotonic()
+        if any(now - entry.expires_at > max_stale for entry in entries):
+            return None
+        stale = not all(entry.fresh for entry in entries)
+        if stale:
+            self.stale_served += 1
+        profile, stats = (entry.value for entry in entries)
+        return Player(profile, stats, stale=stale)
+
+    def expected_latency(self, username: str) -> float:
+        """
+        Rough guess of how long fetch_player will take, 0 if it's cached
+        """
+        if self.is_cached(username):
+            return 0
+        # both endpoints are fetched in parallel, so roughly one request plus
+        # however long the rate limiter's queue takes to drain
+        return self.latency + self.limiter.expected_wait()
+
+    async def get_json(self, path: str, requester=None):
+        """
+        GET a path and decode the JSON body, bypassing the cache
+        """
+        _, _, body = await self.request(path, requester=requester)
+        return body
+
+    async def get_endpoint(
+        self, endpoint: str, username: str, requester=None, *, max_age=None
+    ):
+        """
+        Get one of the ENDPOINTS for a player parsed into its model, served from the
+        cache while fresh. Concurrent misses for the same player share one request,
+        which is moved out of the low priority lane if a normal requester joins it.
+        `requester` identifies who is asking (a guild or user) for fair queueing.
+        With `max_age`, a cached response older than that many seconds is
+        revalidated even if its TTL hasn't run out.
+        """
+        username = normalise(username)
+        key = (endpoint, username)
+        entry = self.cache.get(key)
+        if entry is not None and self.young_enough(endpoint, entry, max_age):
+            return entry.value
+
+        task = self.inflight.get(key)
+        if task is None:
+            ticket = self.tickets[key] = Ticket(requester)
+            task = asyncio.ensure_future(
+                self._fetch_endpoint(endpoint, username, ticket, max_age)
+            )
+            self.inflight[key] = task
+            task.add_done_callback(lambda t: self._finish_inflight(key, t))
+        else:
+            self.coalesced += 1
+            # a command joining a prefetch shouldn't wait in the low priority lane
+            self.limiter.promote(self.tickets[key], requester)
+        # shielded so one caller giving up doesn't cancel the request for the others
+        return await asyncio.shield(task)
+
+    def young_enough(self, endpoint: str, entry, max_age) -> bool:
+        if max_age is None:
+            return True
+        # seconds since the entry was fetched or last revalidated
+        age = self.ttls[endpoint] - (entry.expires_at - time.monotonic())
+        return age <= max_age
+
+    def _finish_inflight(self, key, task: asyncio.Task):
+        self.inflight.pop(key, None)
+        self.tickets.pop(key, None)
+        # mark the exception as retrieved in case every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch_endpoint(
+        self, endpoint: str, username: str, requester=None, max_age=None
+    ):
+        """
+        Request an endpoint, revalidating the expired cache entry if there is one
+        """
+        key = (endpoint, username)
+        stale = self.cache.get_stale(key)
+        if self.store is not None and (stale is None or self.shared):
+            stale = await self._load_stored(endpoint, username) or stale
+            if (
+                stale is not None
+                and stale.fresh
+                and self.young_enough(endpoint, stale, max_age)
+            ):
+                self.store_hits += 1
+                return stale.value
+
+        if not self.shared:
+            return await self._fetch_upstream(endpoint, username, requester, stale)
+        lease = f"{endpoint}:{username}"
+        if not await self.store.claim(lease, self.owner, self.timeout):
+            # another process is fetching it, wait for it to land in the store
+            entry = await self._wait_for_store(endpoint, username)
+            if entry is not None:
+                self.coalesced += 1
+                return entry.value
+            stale = self.cache.get_stale(key)
+            await self.store.claim(lease, self.owner, self.timeout)
+        try:
+            return await self._fetch_upstream(endpoint, username, requester, stale)
+        finally:
+            # queued behind the write-through, so waiters find the response
+            spawn(self.store.release(lease, self.owner), self.background)
+
+    async def _wait_for_store(self, endpoint: str, username: str, interval=0.1):
+        """
+        Poll the store for a fresh response until the other process's lease runs
+        out, None if it never showed up
+        """
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(interval)
+            entry = await self._load_stored(endpoint, username)
+            if entry is not None and entry.fresh:
+                return entry
+        return None
+
+    async def _fetch_upstream(self, endpoint: str, username: str, requester, stale):
+        key = (endpoint, username)
+        headers = {}
+        if stale is not None:
+            if stale.etag:
+                headers["If-None-Match"] = stale.etag
+            if stale.last_modified:
+                headers["If-Modified-Since"] = stale.last_modified
+
+        path = ENDPOINTS[endpoint].format(username=username)
+        status, resp_headers, body = await self.request(
+            path, headers, requester, endpoint
+        )
+        if status == 304 and stale is not None:
+            if self.store is not None:
+                spawn(self.store.touch_response(endpoint, username), self.background)
+            if self.cache.get_stale(key) is None:
+                # evicted while the request was in flight, the validated copy
+                # goes back in
+                self.cache.revalidations += 1
+                return self.cache.put(
+                    key,
+                    stale.value,
+                    self.ttls[endpoint],
+                    etag=stale.etag,
+                    last_modified=stale.last_modified,
+                ).value
+            return self.cache.refresh(key, self.ttls[endpoint]).value
+        if body is None:
+            # a 304 we didn't ask for
+            body = await self.get_json(path, requester)
+            resp_headers = {}
+        value = MODELS[endpoint].from_json(body)
+        self.cache.put(
+            key,
+            value,
+            self.ttls[endpoint],
+            etag=resp_headers.get("ETag"),
+            last_modified=resp_headers.get("Last-Modified"),
+        )
+        if self.store is not None:
+            spawn(
+                self.store.save_response(
+                    endpoint,
+                    username,
+                    value.to_row(),
+                    etag=resp_headers.get("ETag"),
+                    last_modified=resp_headers.get("Last-Modified"),
+                ),
+                self.background,
+            )
+        return value
+
+    async def _load_stored(self, endpoint: str, username: str):
+        """
+        Pull a persisted response into the memory cache, keeping its remaining TTL.
+        Expired rows are loaded too, their validators still save a download.
+        """
+        row = await self.store.load_response(endpoint, username)
+        if row is None:
+            return None
+        body, etag, last_modified, fetched_at = row
+        value = MODELS[endpoint].from_row(body)
+        ttl = self.ttls[endpoint] - (time.time() - fetched_at)
+        return self.cache.put(
+            (endpoint, username), value, ttl, etag=etag, last_modified=last_modified
+        )
+
+    async def fetch_stats(
+        self, username: str, requester=None, *, max_age=None
+    ) -> PlayerStats:
+        """
+        Fetch only the stats of a player, for when the username is already known
+        """
+        return await self.get_endpoint("stats", username, requester, max_age=max_age)
+
+    async def fetch_player(self, username: str, requester=None, *, max_age=None):
+        """
+        Fetch the profile and stats of a player concurrently
+        """
+        results = await asyncio.gather(
+            self.get_endpoint("profile", username, requester, max_age=max_age),
+            self.get_endpoint("stats", username, requester, max_age=max_age),
+            return_exceptions=True,
+        )
+        # report the most specific error first: a missing player beats a rate
+        # limit, which beats a generic failure
+        for error_type in (PlayerNotFound, RateLimited, BaseException):
+            for result in results:
+                if isinstance(result, error_type):
+                    raise result
+        profile, stats = results
+        return Player(profile, stats)
+
+    async def fetch_many(
+        self,
+        usernames,
+        requester=None,
+        *,
+        concurrency: int = 5,
+        stats_only=False,
+        max_age=None,
+    ) -> dict:
+        """
+        Fetch several players with at most `concurrency` of them in flight.
+
+        Returns username -> Player (PlayerStats with `stats_only`), or the
+        ChessComError that player failed with so one failure doesn't sink the rest.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        fetch = self.fetch_stats if stats_only else self.fetch_player
+
+        async def fetch_one(username):
+            async with semaphore:
+                try:
+                    return await fetch(username, requester, max_age=max_age)
+                except ChessComError as e:
+                    return e
+
+        results = await asyncio.gather(*(fetch_one(u) for u in usernames))
+        return dict(zip(usernames, results))
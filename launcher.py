@@ -0,0 +1,116 @@
+import asyncio
+import os
+import signal
+import sys
+import time
+
+import aiohttp
+from dotenv import load_dotenv
+
+from store import Store
+
+load_dotenv()
+
+# Runs the bot as several processes, each with a group of the shards. They all
+# open the same database with SHARED_STORE=1, so the chess.com rate limit, the
+# cached responses and the account links are shared between them. Only the
+# first process syncs the commands. A process that exits is started again, and
+# they're all stopped together on SIGINT/SIGTERM.
+
+# seconds to wait before restarting a process that exited, doubled every time
+# it exits within a minute of starting
+RESTART_DELAY = 1
+RESTART_DELAY_MAX = 60
+
+
+async def recommended_shards(token: str) -> int:
+    """
+    The number of shards Discord recommends for the bot
+    """
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            "https://discord.com/api/v10/gateway/bot",
+            headers={"Authorization": f"Bot {token}"},
+        ) as resp:
+            resp.raise_for_status()
+            return (await resp.json())["shards"]
+
+
+def shard_groups(shard_count: int, processes: int) -> list:
+    """
+    Split the shard ids into `processes` groups of about equal size
+    """
+    processes = max(1, min(processes, shard_count))
+    return [list(range(shard_count))[i::processes] for i in range(processes)]
+
+
+async def supervise(index: int, env: dict, stopping: asyncio.Event, processes: list):
+    """
+    Run one group's process until stopping is set, restarting it when it exits
+    """
+    delay = RESTART_DELAY
+    while not stopping.is_set():
+        started = time.monotonic()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "main.py", env=env
+        )
+        processes[index] = process
+        code = await process.wait()
+        if stopping.is_set():
+            break
+        # a process that keeps crashing right away is restarted less and less often
+        if time.monotonic() - started < 60:
+            delay = min(delay * 2, RESTART_DELAY_MAX)
+        else:
+            delay = RESTART_DELAY
+        print(f"Shards {env['SHARD_IDS']} exited ({code}), restarting in {delay}s")
+        try:
+            await asyncio.wait_for(stopping.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main():
+    shard_count = os.getenv("SHARD_COUNT") or "auto"
+    if shard_count == "auto":
+        shard_count = await recommended_shards(os.getenv("TOKEN"))
+    groups = shard_groups(int(shard_count), int(os.getenv("SHARD_PROCESSES", 2)))
+
+    # create or migrate the database once, before the processes race to do it
+    store = Store(os.getenv("DATABASE_PATH", "chess.db"))
+    await store.open()
+    await store.close()
+
+    metrics_port = int(os.getenv("METRICS_PORT", 9108))
+    stopping = asyncio.Event()
+    processes = [None] * len(groups)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    supervisors = []
+    for index, shard_ids in enumerate(groups):
+        env = dict(
+            os.environ,
+            SHARD_IDS=",".join(map(str, shard_ids)),
+            SHARD_COUNT=str(shard_count),
+            SHARED_STORE="1",
+            SYNC_COMMANDS="1" if index == 0 else "0",
+            # one metrics endpoint per process, 0 keeps them all off
+            METRICS_PORT=str(metrics_port + index if metrics_port else 0),
+        )
+        print(f"Starting shards {env['SHARD_IDS']} of {shard_count}")
+        supervisors.append(
+            asyncio.ensure_future(supervise(index, env, stopping, processes))
+        )
+
+    await stopping.wait()
+    for process in processes:
+        if process is not None and process.returncode is None:
+            # what Ctrl+C sends, discord.py closes the client (and flushes) on it
+            process.send_signal(signal.SIGINT)
+    await asyncio.gather(*supervisors)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+from bisect import bisect_left, insort
+
+from models import TIME_CONTROLS, PlayerStats
+
+
+class Board:
+    """
+    One guild's ranking in one time control, kept sorted as ratings come in.
+
+    Entries are `(-rating, username.lower(), user_id, username)` tuples so the
+    best rating sorts first and ties are broken by name. An update is a bisect
+    to remove the old entry and an insort for the new one, the list is never
+    sorted from scratch.
+    """
+
+    def __init__(self):
+        self.entries = []
+        # user_id -> that user's entry, to find it again on the next update
+        self.by_user = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, user_id: int):
+        return user_id in self.by_user
+
+    def update(self, user_id: int, username: str, rating):
+        """
+        Set a user's rating, None takes them off the board
+        """
+        entry = (
+            None if rating is None else (-rating, username.lower(), user_id, username)
+        )
+        old = self.by_user.get(user_id)
+        if old == entry:
+            return
+        if old is not None:
+            del self.entries[bisect_left(self.entries, old)]
+            del self.by_user[user_id]
+        if entry is not None:
+            insort(self.entries, entry)
+            self.by_user[user_id] = entry
+
+    def remove(self, user_id: int):
+        self.update(user_id, "", None)
+
+    def page(self, page: int, size: int):
+        """
+        `(rank, username, rating)` for the entries on a page, starting at 0
+        """
+        start = page * size
+        return [
+            (start + i + 1, username, -rating)
+            for i, (rating, _, _, username) in enumerate(
+                self.entries[start : start + size]
+            )
+        ]
+
+
+class Leaderboards:
+    """
+    Guild id -> time control -> Board, updated whenever a linked member's stats
+    are fetched (by /leaderboard itself or the nickname sync)
+    """
+
+    def __init__(self):
+        self.guilds = {}
+        # user ids whose stats went into the boards, per guild
+        self.seen = {}
+
+    def board(self, guild_id: int, mode: str) -> Board:
+        boards = self.guilds.setdefault(guild_id, {})
+        board = boards.get(mode)
+        if board is None:
+            board = boards[mode] = Board()
+        return board
+
+    def has(self, guild_id: int, user_id: int) -> bool:
+        return user_id in self.seen.get(guild_id, ())
+
+    def update(self, link, stats: PlayerStats):
+        """
+        Put a linked user's ratings on the boards of every guild they're in
+        """
+        for guild_id in link.boards:
+            self.seen.setdefault(guild_id, set()).add(link.user_id)
+            for mode in TIME_CONTROLS.values():
+                stats_mode = stats.mode(mode.name)
+                self.board(guild_id, mode.name).update(
+                    link.user_id,
+                    link.username,
+                    None if stats_mode is None else stats_mode.rating,
+                )
+
+    def remove(self, user_id: int, guild_ids=None):
+        """
+        Take a user off the boards of the given guilds, all of them by default
+        """
+        for guild_id in list(self.guilds if guild_ids is None else guild_ids):
+            self.seen.get(guild_id, set()).discard(user_id)
+            for board in self.guilds.get(guild_id, {}).values():
+                board.remove(user_id)
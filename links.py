@@ -0,0 +1,179 @@
+import asyncio
+
+
+class Link:
+    """
+    A Discord user's chess.com account
+    """
+
+    __slots__ = ("user_id", "username", "guilds", "ranked")
+
+    def __init__(self, user_id: int, username: str, guilds=(), ranked=()):
+        self.user_id = user_id
+        # properly capitalised, as shown on chess.com
+        self.username = username
+        # guilds the user ran /nick in, where their nickname shows their rating
+        self.guilds = set(guilds)
+        # guilds the user ran /link in, where they're only on the leaderboards
+        self.ranked = set(ranked)
+
+    @property
+    def boards(self) -> set:
+        """
+        The guilds whose leaderboards the user is on
+        """
+        return self.guilds | self.ranked
+
+    def to_row(self) -> tuple:
+        return (
+            self.user_id,
+            self.username,
+            ",".join(map(str, sorted(self.guilds))),
+            ",".join(map(str, sorted(self.ranked))),
+        )
+
+    @classmethod
+    def from_row(cls, row):
+        user_id, username, guilds, ranked = row
+        return cls(
+            user_id,
+            username,
+            (int(g) for g in guilds.split(",") if g),
+            (int(g) for g in ranked.split(",") if g),
+        )
+
+
+class LinkRegistry:
+    """
+    Discord user id -> chess.com account, held in memory.
+
+    Changes are written behind to the Store every `flush_interval` seconds
+    instead of on every command. When other processes share the Store, the
+    links are also reloaded after every flush to pick up their changes.
+    """
+
+    def __init__(self, store, *, flush_interval: float = 5, shared: bool = False):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self.links = {}
+        # user ids changed since the last flush
+        self.dirty = set()
+        self.flusher = None
+
+    def __len__(self):
+        return len(self.links)
+
+    def __iter__(self):
+        return iter(self.links.values())
+
+    async def load(self):
+        await self.reload()
+        self.flusher = asyncio.ensure_future(self._flush_periodically())
+
+    async def close(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+        await self.flush()
+
+    def get(self, user_id: int):
+        return self.links.get(user_id)
+
+    def link(
+        self, user_id: int, username: str, guild_id: int = None, *, nick: bool = True
+    ) -> Link:
+        """
+        Link a user to a chess.com account, remembering the guild it was done in:
+        for rating nicknames with `nick`, otherwise only for the leaderboards
+        """
+        link = self.links.get(user_id)
+        if link is None:
+            link = self.links[user_id] = Link(user_id, username)
+        elif link.username.lower() != username.lower():
+            # a different account, the rating nicknames were for the old one
+            link.ranked |= link.guilds
+            link.guilds.clear()
+        link.username = username
+        if guild_id is not None:
+            if nick:
+                link.guilds.add(guild_id)
+                link.ranked.discard(guild_id)
+            elif guild_id not in link.guilds:
+                link.ranked.add(guild_id)
+        self.dirty.add(user_id)
+        return link
+
+    def unlink(self, user_id: int):
+        """
+        Forget a user's account, returning the removed Link or None
+        """
+        link = self.links.pop(user_id, None)
+        if link is not None:
+            self.dirty.add(user_id)
+        return link
+
+    def remove_guild(self, user_id: int, guild_id: int):
+        """
+        Forget a guild for a user, e.g. when they left it
+        """
+        link = self.links.get(user_id)
+        if link is not None:
+            link.guilds.discard(guild_id)
+            link.ranked.discard(guild_id)
+            self.dirty.add(user_id)
+
+    def in_guild(self, guild_id: int):
+        """
+        The links of users who linked their account in a guild, with /link or /nick
+        """
+        return [
+            link
+            for link in self.links.values()
+            if guild_id in link.guilds or guild_id in link.ranked
+        ]
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, set()
+        rows = [self.links[i].to_row() for i in dirty if i in self.links]
+        deleted = [i for i in dirty if i not in self.links]
+        try:
+            await self.store.save_links(rows, deleted)
+        except Exception:
+            # try again on the next flush
+            self.dirty |= dirty
+            raise
+
+    async def reload(self):
+        """
+        Pick up the stored links, except those changed here since the last flush.
+        Links that are still there are updated in place, so whoever holds one
+        (like a running nickname sync) keeps changing the registry's copy.
+        """
+        links = {}
+        for row in await self.store.load_links():
+            stored = Link.from_row(row)
+            link = self.links.get(stored.user_id)
+            if link is None:
+                link = stored
+            elif stored.user_id not in self.dirty:
+                link.username = stored.username
+                link.guilds = stored.guilds
+                link.ranked = stored.ranked
+            links[link.user_id] = link
+        for user_id in self.dirty:
+            links.pop(user_id, None)
+            if user_id in self.links:
+                links[user_id] = self.links[user_id]
+        self.links = links
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if self.shared:
+                    await self.reload()
+            except Exception as e:
+                print(f"Failed to save linked accounts: {e!r}")
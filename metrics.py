@@ -0,0 +1,325 @@
+import asyncio
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# every metric created, in creation order
+REGISTRY = []
+
+
+class Metric:
+    """
+    Base class of the metrics, one value (or histogram) per set of label values
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        REGISTRY.append(self)
+
+    def samples(self):
+        """
+        Yield `(suffix, labels, value)` for every sample to expose
+        """
+        for labels, value in self.values.items():
+            yield "", labels, value
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(labels)} {value}")
+        return "\n".join(lines)
+
+    def label_values(self, values) -> tuple:
+        return tuple(zip(self.labels, values))
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        key = self.label_values(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, *labels) -> float:
+        return self.values.get(self.label_values(labels), 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[self.label_values(labels)] = value
+
+    def inc(self, *labels, amount: float = 1):
+        key = self.label_values(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def get(self, *labels) -> float:
+        return self.values.get(self.label_values(labels), 0)
+
+
+class Callback(Metric):
+    """
+    A metric read from somewhere else when it's scraped, e.g. the cache counters
+    """
+
+    def __init__(self, name: str, help: str, function, *, type: str = "gauge"):
+        super().__init__(name, help)
+        self.function = function
+        self.type = type
+
+    def samples(self):
+        yield "", (), self.function()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        key = self.label_values(labels)
+        series = self.values.get(key)
+        if series is None:
+            # per-bucket counts (the last one is +Inf), sum and count
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                yield "_bucket", labels + (("le", bound),), cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+    def quantile(self, q: float, *labels):
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in
+        """
+        series = self.values.get(self.label_values(labels))
+        if series is None or series[2] == 0:
+            return None
+        counts, _, count = series
+        rank = q * count
+        cumulative = 0
+        for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels)
+    return "{" + pairs + "}"
+
+
+def expose() -> str:
+    """
+    All metrics in the Prometheus text format
+    """
+    return "\n".join(metric.expose() for metric in REGISTRY) + "\n"
+
+
+# Metrics shared by the whole bot
+command_seconds = Histogram(
+    "bot_command_seconds",
+    "Time from receiving a slash command to finishing it",
+    ("command",),
+)
+commands_total = Counter(
+    "bot_commands_total", "Slash commands handled", ("command", "outcome")
+)
+commands_in_flight = Gauge("bot_commands_in_flight", "Slash commands being handled")
+upstream_seconds = Histogram(
+    "chesscom_request_seconds", "chess.com API request latency", ("endpoint",)
+)
+upstream_responses = Counter(
+    "chesscom_responses_total",
+    "chess.com API responses by status, 0 is a timeout or connection error",
+    ("endpoint", "status"),
+)
+upstream_in_flight = Gauge(
+    "chesscom_requests_in_flight", "chess.com API requests on the wire"
+)
+loop_lag = Histogram(
+    "bot_event_loop_lag_seconds", "How late the event loop ran a scheduled callback"
+)
+nick_sync_members = Counter(
+    "bot_nick_sync_members_total",
+    "Linked members checked by the nickname sync, by outcome",
+    ("outcome",),
+)
+admission_rejections = Counter(
+    "bot_admission_rejections_total",
+    "Slash commands turned away by admission control, by command and limit",
+    ("command", "reason"),
+)
+prefetched = Counter(
+    "bot_prefetched_players_total",
+    "Players the prefetcher looked up ahead of time, by outcome",
+    ("outcome",),
+)
+presence_polls = Counter(
+    "bot_presence_polls_total", "Followed players polled, by outcome", ("outcome",)
+)
+presence_notifications = Counter(
+    "bot_presence_notifications_total",
+    "Follower notifications sent to a channel, by outcome",
+    ("outcome",),
+)
+
+
+def watch(chesscom):
+    """
+    Expose the counters a ChessComClient, its cache and its rate limiter keep
+    """
+    cache = chesscom.cache
+    limiter = chesscom.limiter
+    for name, help, function in (
+        ("chesscom_cache_hits_total", "Cache hits", lambda: cache.hits),
+        ("chesscom_cache_misses_total", "Cache misses", lambda: cache.misses),
+        (
+            "chesscom_cache_revalidations_total",
+            "Cache entries refreshed by a 304",
+            lambda: cache.revalidations,
+        ),
+        (
+            "chesscom_coalesced_total",
+            "Lookups that shared an in-flight request",
+            lambda: chesscom.coalesced,
+        ),
+        (
+            "chesscom_stale_served_total",
+            "Players shown from stale cache entries",
+            lambda: chesscom.stale_served,
+        ),
+        (
+            "chesscom_queue_wait_seconds_total",
+            "Time spent waiting for rate limiter tokens",
+            lambda: limiter.wait_total,
+        ),
+        ("chesscom_throttled_total", "429s from chess.com", lambda: limiter.throttled),
+        ("chesscom_retries_total", "Retried requests", lambda: chesscom.retries),
+    ):
+        Callback(name, help, function, type="counter")
+    for name, help, function in (
+        ("chesscom_cache_entries", "Entries in the memory cache", lambda: len(cache)),
+        (
+            "chesscom_lookups_in_flight",
+            "Distinct lookups waiting for chess.com",
+            lambda: len(chesscom.inflight),
+        ),
+        (
+            "chesscom_queue_depth",
+            "Requests waiting for a rate limiter token",
+            lambda: limiter.depth,
+        ),
+        (
+            "chesscom_low_priority_queue_depth",
+            "Low priority requests (prefetching) waiting for a rate limiter token",
+            lambda: limiter.low_priority_depth,
+        ),
+    ):
+        Callback(name, help, function)
+
+
+def watch_nick_sync(sync):
+    """
+    Expose the progress of the nickname sync's current cycle
+    """
+    Callback(
+        "bot_nick_sync_done", "Links checked in the current cycle", lambda: sync.done
+    )
+    Callback(
+        "bot_nick_sync_total", "Links to check in the current cycle", lambda: sync.total
+    )
+
+
+def watch_prefetch(prefetcher):
+    """
+    Expose how many of the lookups right after startup were answered from memory
+    """
+    for name, help, function in (
+        (
+            "bot_cold_start_lookups_total",
+            "Lookups in the window after startup",
+            lambda: prefetcher.lookups,
+        ),
+        (
+            "bot_cold_start_hits_total",
+            "Lookups in the window after startup answered from memory",
+            lambda: prefetcher.hits,
+        ),
+        (
+            "bot_cold_start_prefetched_hits_total",
+            "Lookups in the window after startup answered thanks to prefetching",
+            lambda: prefetcher.prefetched_hits,
+        ),
+    ):
+        Callback(name, help, function, type="counter")
+
+
+def watch_presence(tracker):
+    """
+    Expose how many players are followed and by how many follows
+    """
+    Callback(
+        "bot_presence_players",
+        "Followed players being polled",
+        lambda: len(tracker.watches),
+    )
+    Callback(
+        "bot_presence_follows",
+        "Follows of chess.com players",
+        lambda: sum(len(followers) for followers in tracker.follows.values()),
+    )
+
+
+async def monitor_loop_lag(interval: float = 0.5):
+    """
+    Measure how late a sleep wakes up, a blocked event loop shows up as lag
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag.observe(max(0.0, time.perf_counter() - started - interval))
+
+
+async def serve(host: str, port: int) -> web.AppRunner:
+    """
+    Serve /metrics over HTTP. Bind to localhost, there is no authentication.
+    """
+
+    async def handler(request):
+        return web.Response(
+            body=expose().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
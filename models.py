@@ -0,0 +1,278 @@
+import sys
+
+# Compact records of the parts of chess.com responses the bot actually uses.
+# Responses are parsed into these once when they are fetched and the decoded JSON
+# is thrown away, so the caches only hold a few slotted objects per player.
+# Missing values are None instead of a KeyError waiting to happen.
+
+
+class TimeControl:
+    """
+    A time control with a stats section in `/player/{username}/stats`
+    """
+
+    __slots__ = ("name", "key", "label", "overview")
+
+    def __init__(self, name: str, key: str, label: str, *, overview: bool = False):
+        # command name, key in the stats response, display name, and whether
+        # it gets a field in the /chess overview
+        self.name = name
+        self.key = key
+        self.label = label
+        self.overview = overview
+
+
+# Every time control the bot knows about. Adding one here is enough to give it a
+# command of its own.
+TIME_CONTROLS = {
+    mode.name: mode
+    for mode in (
+        TimeControl("rapid", "chess_rapid", "Rapid", overview=True),
+        TimeControl("blitz", "chess_blitz", "Blitz", overview=True),
+        TimeControl("bullet", "chess_bullet", "Bullet", overview=True),
+        TimeControl("daily", "chess_daily", "Daily"),
+        TimeControl("daily960", "chess960_daily", "Daily 960"),
+    )
+}
+
+
+class ModeStats:
+    """
+    Rating and record of a player in one time control
+    """
+
+    __slots__ = (
+        "rating",
+        "rating_date",
+        "wins",
+        "losses",
+        "draws",
+        "best_rating",
+        "best_game",
+    )
+
+    def __init__(
+        self, rating, rating_date, wins, losses, draws, best_rating, best_game
+    ):
+        self.rating = rating
+        self.rating_date = rating_date
+        self.wins = wins
+        self.losses = losses
+        self.draws = draws
+        self.best_rating = best_rating
+        self.best_game = best_game
+
+    @classmethod
+    def from_json(cls, section: dict):
+        """
+        Parse a `chess_*` section, None if the player has no rated games in it
+        """
+        last = section.get("last", {})
+        record = section.get("record", {})
+        if "rating" not in last or "win" not in record:
+            return None
+        best = section.get("best", {})
+        return cls(
+            last["rating"],
+            last.get("date"),
+            record["win"],
+            record.get("loss", 0),
+            record.get("draw", 0),
+            best.get("rating"),
+            best.get("game"),
+        )
+
+    @property
+    def games(self) -> int:
+        return self.wins + self.losses + self.draws
+
+    def to_row(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    # compared by value, so unchanged stats hit the render caches
+    def __eq__(self, other):
+        return isinstance(other, ModeStats) and self.to_row() == other.to_row()
+
+    def __hash__(self):
+        return hash(self.to_row())
+
+
+class PlayerStats:
+    """
+    The parsed `/player/{username}/stats` response
+    """
+
+    __slots__ = ("modes", "puzzle_rating", "puzzle_date")
+
+    def __init__(self, modes: dict, puzzle_rating=None, puzzle_date=None):
+        # time control name -> ModeStats, only for time controls with games
+        self.modes = modes
+        self.puzzle_rating = puzzle_rating
+        self.puzzle_date = puzzle_date
+
+    @classmethod
+    def from_json(cls, data: dict):
+        modes = {}
+        for mode in TIME_CONTROLS.values():
+            section = data.get(mode.key)
+            if section:
+                stats = ModeStats.from_json(section)
+                if stats is not None:
+                    modes[mode.name] = stats
+        highest = data.get("tactics", {}).get("highest", {})
+        return cls(modes, highest.get("rating"), highest.get("date"))
+
+    def mode(self, name: str):
+        """
+        The ModeStats for a time control, or None if the player has no games in it
+        """
+        return self.modes.get(name)
+
+    def to_row(self):
+        modes = {name: stats.to_row() for name, stats in self.modes.items()}
+        return [modes, self.puzzle_rating, self.puzzle_date]
+
+    @classmethod
+    def from_row(cls, row):
+        modes, puzzle_rating, puzzle_date = row
+        modes = {name: ModeStats(*stats) for name, stats in modes.items()}
+        return cls(modes, puzzle_rating, puzzle_date)
+
+
+class PlayerProfile:
+    """
+    The parsed `/player/{username}` response
+    """
+
+    __slots__ = ("username", "avatar", "joined", "country", "last_online")
+
+    def __init__(self, username, avatar, joined, country, last_online):
+        self.username = username
+        self.avatar = avatar
+        self.joined = joined
+        self.country = country
+        self.last_online = last_online
+
+    @classmethod
+    def from_json(cls, data: dict):
+        # the only way to get properly capitalised username is to get it from the profile url
+        username = data["url"].split("/")[-1]
+        # strip the country code from the url, there are only a few hundred of them
+        country = data.get("country")
+        if country:
+            country = sys.intern(country.split("/")[-1])
+        return cls(
+            username,
+            data.get("avatar"),
+            data.get("joined"),
+            country,
+            data.get("last_online"),
+        )
+
+    def to_row(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+
+# game results that end in a draw, every other result than "win" is a loss
+DRAW_RESULTS = frozenset(
+    {
+        "agreed",
+        "repetition",
+        "stalemate",
+        "insufficient",
+        "50move",
+        "timevsinsufficient",
+    }
+)
+
+
+class Game:
+    """
+    One finished game from a monthly archive, seen from one player's side
+    """
+
+    __slots__ = (
+        "url",
+        "end_time",
+        "time_class",
+        "rules",
+        "colour",
+        "result",
+        "rating",
+        "opponent",
+        "opponent_rating",
+        "eco",
+        "opening",
+        "moves",
+    )
+
+    def __init__(
+        self,
+        url,
+        end_time,
+        time_class,
+        rules,
+        colour,
+        result,
+        rating,
+        opponent,
+        opponent_rating,
+        eco=None,
+        opening=None,
+        moves=None,
+    ):
+        self.url = url
+        self.end_time = end_time
+        # "rapid", "blitz", "bullet" or "daily", and "chess" or a variant
+        self.time_class = time_class
+        self.rules = rules
+        # "white" or "black", and "win", "draw" or "loss"
+        self.colour = colour
+        self.result = result
+        self.rating = rating
+        self.opponent = opponent
+        self.opponent_rating = opponent_rating
+        # parsed from the PGN by the analysis workers, None until then
+        self.eco = eco
+        self.opening = opening
+        self.moves = moves
+
+    @classmethod
+    def from_json(cls, data: dict, username: str):
+        """
+        Parse a game from an archive for `username` (lowercase), None if they
+        didn't play in it
+        """
+        white = data.get("white", {})
+        black = data.get("black", {})
+        if white.get("username", "").lower() == username:
+            colour, player, opponent = "white", white, black
+        elif black.get("username", "").lower() == username:
+            colour, player, opponent = "black", black, white
+        else:
+            return None
+        result = player.get("result")
+        if result != "win":
+            result = "draw" if result in DRAW_RESULTS else "loss"
+        return cls(
+            data.get("url"),
+            data.get("end_time", 0),
+            sys.intern(data.get("time_class", "unknown")),
+            sys.intern(data.get("rules", "chess")),
+            colour,
+            result,
+            player.get("rating"),
+            opponent.get("username"),
+            opponent.get("rating"),
+        )
+
+    def to_row(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
@@ -0,0 +1,192 @@
+import asyncio
+import time
+
+import discord
+
+import metrics
+from background import spawn
+from chesscom import ChessComError, PlayerNotFound
+from render import nickname
+
+# who sync requests are queued under in the rate limiter, so the whole sync gets
+# one fair share next to the guilds running commands
+REQUESTER = ("sync", 0)
+
+
+def owns_guild(client: discord.Client, guild_id: int) -> bool:
+    """
+    Whether a guild is on one of the shards this process runs (0 for DMs, which
+    always arrive on shard 0)
+    """
+    shard_ids = getattr(client, "shard_ids", None)
+    if shard_ids is None or not client.shard_count:
+        return True
+    return (guild_id >> 22) % client.shard_count in shard_ids
+
+
+class NicknameSync:
+    """
+    Keeps the rating in the nicknames /nick set up to date.
+
+    Every `period` seconds all linked members are checked once, spread evenly over
+    the period with at most `concurrency` members in flight. A member is only
+    edited when the rendered nickname changed, and edits are paced to
+    `edits_per_second` on top of discord.py's per-route rate limit handling.
+    """
+
+    def __init__(
+        self,
+        client: discord.Client,
+        *,
+        period: float = 3600,
+        concurrency: int = 4,
+        edits_per_second: float = 1,
+    ):
+        self.client = client
+        self.period = period
+        self.concurrency = concurrency
+        self.edit_interval = 1 / edits_per_second
+        # (guild_id, user_id) -> the nickname the member was last seen with or set to
+        self.applied = {}
+        self.edit_lock = asyncio.Lock()
+        self.last_edit = 0.0
+        self.task = None
+        # progress of the running cycle
+        self.done = 0
+        self.total = 0
+        self.cycles = 0
+
+    def start(self):
+        if self.period > 0:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def owns(self, guild_id: int) -> bool:
+        # the processes running the other shards sync the rest
+        return owns_guild(self.client, guild_id)
+
+    def remember(self, guild_id: int, user_id: int, nick: str):
+        """
+        Record a nickname set elsewhere (by /nick) so it isn't edited again
+        """
+        self.applied[guild_id, user_id] = nick
+
+    async def run(self):
+        await self.client.wait_until_ready()
+        while True:
+            started = time.monotonic()
+            try:
+                await self.sync_all()
+            except Exception as e:
+                print(f"Nickname sync failed: {e!r}")
+            # a short cycle (few links) still waits out the period
+            await asyncio.sleep(max(0.0, self.period - (time.monotonic() - started)))
+
+    async def sync_all(self):
+        """
+        Check every linked member once, spread over the period
+        """
+        # members only on leaderboards are checked too, to keep their ratings current
+        links = [
+            link
+            for link in self.client.links
+            if any(self.owns(guild_id) for guild_id in link.boards)
+        ]
+        self.done = 0
+        self.total = len(links)
+        if not links:
+            return
+        interval = self.period / len(links)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+
+        for link in links:
+            await semaphore.acquire()
+            task = spawn(self.sync_link(link), tasks)
+            task.add_done_callback(lambda _: semaphore.release())
+            await asyncio.sleep(interval)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.cycles += 1
+        counts = ", ".join(
+            f"{metrics.nick_sync_members.get(outcome):.0f} {outcome}"
+            for outcome in ("updated", "unchanged", "forbidden", "gone", "failed")
+        )
+        print(
+            f"Nickname sync {self.cycles} checked {self.total} links ({counts} total)"
+        )
+
+    async def sync_link(self, link):
+        try:
+            stats = await self.client.chesscom.fetch_stats(link.username, REQUESTER)
+        except PlayerNotFound:
+            # the chess.com account was closed, leave the nickname alone
+            self.count("gone", len(link.guilds))
+            return
+        except ChessComError:
+            self.count("failed", len(link.guilds))
+            return
+        finally:
+            self.done += 1
+
+        self.client.leaderboards.update(link, stats)
+        nick = nickname(link.username, stats)
+        for guild_id in [g for g in link.guilds if self.owns(g)]:
+            await self.sync_member(link, guild_id, nick)
+
+    async def sync_member(self, link, guild_id: int, nick: str) -> str:
+        """
+        Set a member's rating nickname if it changed, returning the outcome
+        """
+        guild = self.client.get_guild(guild_id)
+        if guild is None:
+            # the bot was removed from the guild
+            self.forget(link, guild_id)
+            return self.count("gone")
+        key = (guild_id, link.user_id)
+        # the member cache only has members with the members intent, otherwise
+        # compare against the last nickname we know of
+        member = guild.get_member(link.user_id)
+        current = member.nick if member is not None else self.applied.get(key)
+        if current == nick:
+            return self.count("unchanged")
+
+        try:
+            if member is None:
+                member = await guild.fetch_member(link.user_id)
+                if member.nick == nick:
+                    self.applied[key] = nick
+                    return self.count("unchanged")
+            async with self.edit_lock:
+                wait = self.last_edit + self.edit_interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self.last_edit = time.monotonic()
+                await member.edit(nick=nick)
+        except discord.Forbidden:
+            # server owner or a role above the bot's
+            return self.count("forbidden")
+        except discord.NotFound:
+            # the member left the guild
+            self.forget(link, guild_id)
+            return self.count("gone")
+        except discord.HTTPException:
+            return self.count("failed")
+        self.applied[key] = nick
+        return self.count("updated")
+
+    def forget(self, link, guild_id: int):
+        # through the registry, `link` may be an older copy since replaced by a reload
+        link.guilds.discard(guild_id)
+        link.ranked.discard(guild_id)
+        self.client.links.remove_guild(link.user_id, guild_id)
+        self.client.leaderboards.remove(link.user_id, [guild_id])
+        self.applied.pop((guild_id, link.user_id), None)
+
+    def count(self, outcome: str, amount: int = 1) -> str:
+        metrics.nick_sync_members.inc(outcome, amount=amount)
+        return outcome
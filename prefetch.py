@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import discord
+
+import metrics
+from background import spawn
+from chesscom import ChessComError, normalise
+
+# who prefetches are queued under, a low priority kind for the rate limiter
+REQUESTER = ("prefetch", 0)
+
+
+class Prefetcher:
+    """
+    Warms the cache for the players most likely to be looked up next: linked
+    accounts and the `top` most looked up players in the lookup history once the
+    bot is ready, and a member's linked account when they join a guild.
+
+    Its requests are low priority in the rate limiter, so they only use tokens
+    no command is waiting for. To see whether it helps, the lookups in the first
+    `window` seconds after startup are counted along with how many of them were
+    answered from memory.
+    """
+
+    def __init__(
+        self,
+        client: discord.Client,
+        *,
+        top: int = 200,
+        concurrency: int = 2,
+        window: float = 600,
+        flush_interval: float = 60,
+    ):
+        self.client = client
+        self.top = top
+        self.concurrency = concurrency
+        self.window = window
+        self.flush_interval = flush_interval
+        # lookups per username not saved to the history yet
+        self.counts = {}
+        self.flusher = None
+        self.tasks = set()
+        # usernames warmed by the prefetcher
+        self.prefetched = set()
+        # cold start window, from the first on_ready
+        self.ready_at = None
+        self.lookups = 0
+        self.hits = 0
+        self.prefetched_hits = 0
+
+    def start(self):
+        self.flusher = asyncio.ensure_future(self._flush_periodically())
+
+    async def close(self):
+        for task in (self.flusher, *self.tasks):
+            if task is not None:
+                task.cancel()
+        await self.flush()
+
+    def record(self, username: str):
+        """
+        Count a lookup in the history
+        """
+        username = normalise(username)
+        self.counts[username] = self.counts.get(username, 0) + 1
+
+    def observe(self, username: str):
+        """
+        Count whether a lookup could be answered from memory, in the cold start
+        window. Called before the lookup.
+        """
+        if self.ready_at is None or time.monotonic() - self.ready_at > self.window:
+            return
+        self.lookups += 1
+        if self.client.chesscom.is_cached(username):
+            self.hits += 1
+            if normalise(username) in self.prefetched:
+                self.prefetched_hits += 1
+
+    def warm(self, usernames):
+        """
+        Prefetch players in the background
+        """
+        spawn(self._warm(list(usernames)), self.tasks)
+
+    def warm_start(self):
+        """
+        Prefetch the linked accounts and the most looked up players in the
+        background, and start the cold start window
+        """
+        self.ready_at = time.monotonic()
+        spawn(self._warm_start(), self.tasks)
+
+    async def _warm_start(self):
+        usernames = {normalise(link.username) for link in self.client.links}
+        usernames.update(await self.client.store.load_top_lookups(self.top))
+        started = time.monotonic()
+        warmed = await self._warm(usernames)
+        print(
+            f"Prefetched {warmed}/{len(usernames)} players in "
+            f"{time.monotonic() - started:.1f}s"
+        )
+        await asyncio.sleep(max(0.0, self.ready_at + self.window - time.monotonic()))
+        hit_rate = self.hits / self.lookups if self.lookups else 0
+        print(
+            f"Cold start: {self.hits}/{self.lookups} lookups ({hit_rate:.0%}) in the "
+            f"first {self.window:.0f}s were cached, {self.prefetched_hits} prefetched"
+        )
+
+    async def _warm(self, usernames) -> int:
+        chesscom = self.client.chesscom
+        usernames = [
+            normalise(username)
+            for username in usernames
+            if not chesscom.is_cached(username) and not chesscom.is_fetching(username)
+        ]
+        results = await self.client.chesscom.fetch_many(
+            usernames, REQUESTER, concurrency=self.concurrency
+        )
+        warmed = 0
+        for username, result in results.items():
+            if isinstance(result, ChessComError):
+                metrics.prefetched.inc("failed")
+            else:
+                metrics.prefetched.inc("warmed")
+                self.prefetched.add(username)
+                warmed += 1
+        return warmed
+
+    async def flush(self):
+        if not self.counts:
+            return
+        counts, self.counts = self.counts, {}
+        try:
+            await self.client.store.save_lookups(counts)
+        except Exception:
+            # add them back for the next flush
+            for username, count in counts.items():
+                self.counts[username] = self.counts.get(username, 0) + count
+            raise
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Failed to save the lookup history: {e!r}")
@@ -0,0 +1,291 @@
+import asyncio
+import heapq
+import random
+import time
+
+import discord
+
+import metrics
+from chesscom import ChessComError, PlayerNotFound, normalise
+from nicksync import owns_guild
+from render import render_presence
+
+# who presence polls are queued under in the rate limiter, one fair share for all
+REQUESTER = ("presence", 0)
+
+
+class Follow:
+    """
+    A Discord user following a chess.com player, notified in the channel they
+    ran /follow in
+    """
+
+    __slots__ = ("user_id", "username", "guild_id", "channel_id")
+
+    def __init__(self, user_id: int, username: str, guild_id, channel_id: int):
+        self.user_id = user_id
+        # normalised, like the cache keys
+        self.username = username
+        # None for a DM
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+
+    def to_row(self) -> tuple:
+        return self.user_id, self.username, self.guild_id, self.channel_id
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+
+class Watch:
+    """
+    What the last poll of a followed player saw
+    """
+
+    __slots__ = ("username", "interval", "due", "online", "games")
+
+    def __init__(self, username: str, interval: float):
+        self.username = username
+        self.interval = interval
+        self.due = 0.0
+        self.online = False
+        # time control name -> (date, rating) of the last rated game, None
+        # before the first poll
+        self.games = None
+
+
+class PresenceTracker:
+    """
+    Tells followers when a chess.com player comes online or finishes a game.
+
+    Each followed player is polled once no matter how many users follow it, on
+    an interval of its own: `min_interval` while it's active, doubling with every
+    quiet poll up to `max_interval`. Players that are due are polled together in
+    batches of `batch_size`. Polls revalidate anything cached for longer than
+    half the minimum interval, so they don't just see the cache.
+    """
+
+    def __init__(
+        self,
+        client: discord.Client,
+        *,
+        min_interval: float = 60,
+        max_interval: float = 3600,
+        online_window: float = 300,
+        batch_size: int = 20,
+        concurrency: int = 4,
+        max_follows: int = 25,
+    ):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # seconds since last_online for a player to count as online, like /chess
+        self.online_window = online_window
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        # per Discord user
+        self.max_follows = max_follows
+        # username -> user id -> Follow
+        self.follows = {}
+        # username -> Watch, and a heap of (due, username) with an entry for
+        # every time a watch was scheduled, those not matching watch.due are stale
+        self.watches = {}
+        self.queue = []
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    async def load(self):
+        """
+        Load the follows of the guilds on this process's shards
+        """
+        for row in await self.client.store.load_follows():
+            follow = Follow.from_row(row)
+            if owns_guild(self.client, follow.guild_id or 0):
+                self.add(follow)
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def following(self, user_id: int) -> list:
+        """
+        The Follows of a user, sorted by username
+        """
+        follows = [
+            followers[user_id]
+            for followers in self.follows.values()
+            if user_id in followers
+        ]
+        return sorted(follows, key=lambda follow: follow.username)
+
+    async def follow(
+        self, user_id: int, username: str, guild_id, channel_id: int
+    ) -> bool:
+        """
+        Follow a player, False if the user already follows as many as allowed
+        """
+        username = normalise(username)
+        followers = self.follows.get(username, {})
+        following = len(self.following(user_id))
+        if user_id not in followers and following >= self.max_follows:
+            return False
+        follow = Follow(user_id, username, guild_id, channel_id)
+        await self.client.store.save_follow(follow.to_row())
+        self.add(follow)
+        return True
+
+    async def unfollow(self, user_id: int, username: str):
+        """
+        Stop following a player, returning the removed Follow or None
+        """
+        username = normalise(username)
+        follow = self.follows.get(username, {}).pop(user_id, None)
+        if follow is None:
+            return None
+        await self.client.store.delete_follow(user_id, username)
+        if not self.follows[username]:
+            # nobody left to tell, the heap entry goes stale
+            del self.follows[username]
+            self.watches.pop(username, None)
+        return follow
+
+    def add(self, follow: Follow):
+        self.follows.setdefault(follow.username, {})[follow.user_id] = follow
+        if follow.username not in self.watches:
+            watch = self.watches[follow.username] = Watch(
+                follow.username, self.min_interval
+            )
+            self.schedule(watch, 0)
+
+    def schedule(self, watch: Watch, delay: float):
+        watch.due = time.monotonic() + delay
+        heapq.heappush(self.queue, (watch.due, watch.username))
+        self.wakeup.set()
+
+    async def run(self):
+        await self.client.wait_until_ready()
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            due = []
+            while self.queue and self.queue[0][0] <= now and len(due) < self.batch_size:
+                when, username = heapq.heappop(self.queue)
+                watch = self.watches.get(username)
+                if watch is not None and watch.due == when:
+                    due.append(watch)
+            if due:
+                try:
+                    await self.poll(due)
+                except Exception as e:
+                    print(f"Presence poll failed: {e!r}")
+                    # put back whoever didn't get rescheduled before it failed
+                    for watch in due:
+                        if watch.due <= now and watch.username in self.watches:
+                            self.schedule(watch, watch.interval)
+                continue
+
+            # sleep until the next player is due or a new one is followed
+            timeout = self.queue[0][0] - now if self.queue else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def poll(self, watches: list):
+        """
+        Poll a batch of players and tell the followers of those that did something
+        """
+        results = await self.client.chesscom.fetch_many(
+            [watch.username for watch in watches],
+            REQUESTER,
+            concurrency=self.concurrency,
+            max_age=self.min_interval / 2,
+        )
+        for watch in watches:
+            player = results[watch.username]
+            if isinstance(player, PlayerNotFound):
+                # the account was closed, check back rarely in case it's reopened
+                metrics.presence_polls.inc("gone")
+                watch.interval = self.max_interval
+            elif isinstance(player, ChessComError):
+                metrics.presence_polls.inc("failed")
+            else:
+                metrics.presence_polls.inc("ok")
+                online, games = self.observe(watch, player)
+                if online or games:
+                    await self.notify(
+                        watch.username, render_presence(player, online, games)
+                    )
+            if watch.username in self.watches:
+                # jittered so players followed together don't stay in lockstep
+                self.schedule(watch, watch.interval * random.uniform(0.9, 1.1))
+
+    def observe(self, watch: Watch, player):
+        """
+        Update a watch from a poll and adapt its interval. Returns whether the
+        player just came online and `(time control, rating, change)` for every
+        game finished since the last poll.
+        """
+        now = time.time()
+        last_online = player.profile.last_online
+        online = last_online is not None and now - last_online < self.online_window
+        games = {
+            name: (stats.rating_date or 0, stats.rating)
+            for name, stats in player.stats.modes.items()
+        }
+        first, previous = watch.games is None, watch.games or {}
+        watch.games = games
+
+        came_online = online and not watch.online and not first
+        watch.online = online
+        finished = []
+        if not first:
+            for name, (date, rating) in games.items():
+                old_date, old_rating = previous.get(name, (0, None))
+                if date > old_date:
+                    change = rating - old_rating if old_rating is not None else None
+                    finished.append((name, rating, change))
+
+        if online or finished:
+            watch.interval = self.min_interval
+        elif first:
+            # start out as slow as the player has been quiet for
+            latest = max([last_online or 0] + [date for date, _ in games.values()])
+            idle = now - latest
+            watch.interval = min(self.max_interval, max(self.min_interval, idle / 8))
+        else:
+            watch.interval = min(self.max_interval, watch.interval * 2)
+        return came_online, finished
+
+    async def notify(self, username: str, reply):
+        """
+        Send a reply to every channel with followers of a player, mentioning them
+        """
+        channels = {}
+        for follow in self.follows.get(username, {}).values():
+            channels.setdefault((follow.channel_id, follow.guild_id), []).append(
+                follow.user_id
+            )
+        for (channel_id, guild_id), user_ids in channels.items():
+            channel = self.client.get_partial_messageable(channel_id, guild_id=guild_id)
+            try:
+                await channel.send(
+                    " ".join(f"<@{user_id}>" for user_id in user_ids),
+                    embed=reply.embed,
+                    allowed_mentions=discord.AllowedMentions(
+                        everyone=False, roles=False
+                    ),
+                )
+            except discord.NotFound:
+                # the channel was deleted, its follows have nowhere to go
+                metrics.presence_notifications.inc("gone")
+                for user_id in user_ids:
+                    await self.unfollow(user_id, username)
+            except discord.HTTPException:
+                metrics.presence_notifications.inc("failed")
+            else:
+                metrics.presence_notifications.inc("sent")
@@ -0,0 +1,261 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from background import spawn
+
+
+class Ticket:
+    """
+    A request's place in the rate limiter's queues, for requests that may have
+    to move to another key while they wait (see RateLimiter.promote). Pass it to
+    acquire instead of the key.
+    """
+
+    __slots__ = ("key", "queues", "item")
+
+    def __init__(self, key=None):
+        self.key = key
+        # where the request is waiting, None while it isn't
+        self.queues = None
+        self.item = None
+
+
+class RateLimiter:
+    """
+    Token bucket in front of all chess.com traffic.
+
+    Waiting requests are queued per key (a guild or a user) and tokens are handed
+    out round-robin between the keys, so one busy guild can't starve the others.
+    A key like `("guild", 1, 2)` is a user's queue inside their guild's: the
+    users of a guild take turns at the guild's share. Keys like `("prefetch", 0)`
+    whose kind is in `low_priority` only get a token when nobody else is waiting.
+    """
+
+    def __init__(
+        self, rate: float = 10, burst: int = 10, *, low_priority=("prefetch",)
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.low_priority = frozenset(low_priority)
+        # group -> key -> deque of (future, enqueued_at), for normal and low
+        # priority keys, the group being the key without its third item
+        self.queues = OrderedDict()
+        self.idle_queues = OrderedDict()
+        self.dispatcher = None
+        # metrics
+        self.granted = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def depth(self) -> int:
+        return _depth(self.queues)
+
+    @property
+    def low_priority_depth(self) -> int:
+        return _depth(self.idle_queues)
+
+    def expected_wait(self) -> float:
+        """
+        Roughly how long a request queued now would wait for its token
+        """
+        now = time.monotonic()
+        self._refill(now)
+        paused = max(0.0, self.paused_until - now)
+        return paused + max(0.0, self.depth + 1 - self.tokens) / self.rate
+
+    def is_low_priority(self, key) -> bool:
+        return isinstance(key, tuple) and bool(key) and key[0] in self.low_priority
+
+    async def acquire(self, key=None):
+        """
+        Wait for a token, queued fairly behind other requests for the same key.
+        `key` can be a Ticket.
+        """
+        ticket = key if isinstance(key, Ticket) else None
+        if ticket is not None:
+            key = ticket.key
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queues = self.idle_queues if self.is_low_priority(key) else self.queues
+        item = (future, time.monotonic())
+        _enqueue(queues, key, item)
+        if ticket is not None:
+            ticket.queues, ticket.item = queues, item
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.ensure_future(self._dispatch())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if ticket is not None:
+                # it may have been promoted meanwhile
+                queues, key = ticket.queues, ticket.key
+            self._discard(queues, key, future)
+            raise
+        finally:
+            if ticket is not None:
+                ticket.queues = ticket.item = None
+
+    def promote(self, ticket: Ticket, key):
+        """
+        Move a low priority ticket to a normal key, e.g. when a command ends up
+        waiting on a prefetch. Its retries queue under the new key too. Does
+        nothing if `key` is low priority as well.
+        """
+        if not self.is_low_priority(ticket.key) or self.is_low_priority(key):
+            return
+        old_key, ticket.key = ticket.key, key
+        if ticket.item is None or ticket.queues is not self.idle_queues:
+            # not waiting for a token right now
+            return
+        self._discard(self.idle_queues, old_key, ticket.item[0])
+        _enqueue(self.queues, key, ticket.item)
+        ticket.queues = self.queues
+
+    def pause(self, seconds: float):
+        """
+        Stop handing out tokens for a while, e.g. when chess.com sent Retry-After
+        """
+        self.throttled += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _discard(self, queues, key, future):
+        group = queues.get(_group(key))
+        queue = group.get(key) if group is not None else None
+        if queue is None:
+            return
+        for item in queue:
+            if item[0] is future:
+                queue.remove(item)
+                break
+        if not queue:
+            del group[key]
+            if not group:
+                del queues[_group(key)]
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def _take(self) -> float:
+        """
+        Take a token, or return how many seconds to wait before trying again
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        return 0.0
+
+    async def _refund(self):
+        """
+        Put back a token that was taken for nobody
+        """
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def _next(self):
+        """
+        Pop the next waiter round-robin between the groups and between the keys
+        within the group, low priority keys only once nobody else is waiting.
+        None if nobody's waiting at all.
+        """
+        for queues in (self.queues, self.idle_queues):
+            while queues:
+                # serve the group and key at the front, then move them to the
+                # back of their lines
+                name, group = next(iter(queues.items()))
+                key, queue = next(iter(group.items()))
+                item = queue.popleft()
+                if queue:
+                    group.move_to_end(key)
+                else:
+                    del group[key]
+                if group:
+                    queues.move_to_end(name)
+                else:
+                    del queues[name]
+                if not item[0].done():
+                    return item
+        return None
+
+    async def _dispatch(self):
+        while self.queues or self.idle_queues:
+            wait = await self._take()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            item = self._next()
+            if item is None:
+                # everyone waiting gave up meanwhile
+                await self._refund()
+                break
+
+            future, enqueued_at = item
+            self.granted += 1
+            waited = time.monotonic() - enqueued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            future.set_result(None)
+
+    def counters(self) -> dict:
+        return {
+            "queue_depth": self.depth,
+            "queues": len(self.queues),
+            "low_priority_depth": self.low_priority_depth,
+            "granted": self.granted,
+            "throttled": self.throttled,
+            "wait_avg": self.wait_total / self.granted if self.granted else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+
+def _group(key):
+    """
+    The queue a key takes turns in, `(kind, id)` for a `(kind, id, sub)` key
+    """
+    if isinstance(key, tuple) and len(key) > 2:
+        return key[:2]
+    return key
+
+
+def _enqueue(queues, key, item):
+    queues.setdefault(_group(key), OrderedDict()).setdefault(key, deque()).append(item)
+
+
+def _depth(queues) -> int:
+    return sum(len(queue) for group in queues.values() for queue in group.values())
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter whose token bucket (and Retry-After pause) lives in the Store, so
+    every process using the same database stays under one chess.com limit
+    together. Requests are still queued fairly within each process.
+    """
+
+    def __init__(self, store, rate: float = 10, burst: int = 10, *, name="chesscom"):
+        super().__init__(rate, burst)
+        self.store = store
+        self.name = name
+
+    async def _take(self) -> float:
+        wait, tokens = await self.store.take_token(self.name, self.rate, self.burst)
+        # remembered for expected_wait
+        self.tokens = tokens
+        self.updated = time.monotonic()
+        return wait
+
+    async def _refund(self):
+        self.tokens = await self.store.refund_token(self.name, self.burst)
+
+    def pause(self, seconds: float):
+        super().pause(seconds)
+        spawn(self.store.pause_bucket(self.name, seconds))
@@ -0,0 +1,528 @@
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import discord
+
+from chesscom import Player, PlayerNotFound
+from leaderboard import Board
+from models import TIME_CONTROLS, ModeStats, PlayerStats, TimeControl
+from responses import Reply
+
+
+def nickname(username: str, stats: PlayerStats) -> str:
+    """
+    The nickname /nick sets: the username with the rapid rating if there is one
+    """
+    rapid = stats.mode("rapid")
+    if rapid is None:
+        return username
+    return f"{username} ({rapid.rating})"
+
+
+def format_date(timestamp) -> str:
+    if timestamp is None:
+        return "Unknown"
+    return datetime.fromtimestamp(timestamp).strftime("%d.%m.%Y")
+
+
+def format_last_online(timestamp) -> str:
+    if timestamp is None:
+        return "Unknown"
+    last_online = datetime.fromtimestamp(timestamp)
+    # if the user was online in the last 5 minutes, they are online
+    if last_online > datetime.now() - timedelta(minutes=5):
+        return "Online"
+    return last_online.strftime("%d.%m.%Y %H:%M:%S")
+
+
+def not_found(label: str) -> Reply:
+    embed = discord.Embed(
+        title=f"No {label} stats found",
+        description=f"This user doesn't have any {label} stats",
+        color=0xFF0000,
+    )
+    return Reply(embed)
+
+
+# The render_* functions pull out the handful of values an embed shows and pass
+# them to a memoised builder, so a player whose numbers haven't changed gets the
+# already built embed back instead of being formatted again.
+
+
+def render_mode(player: Player, mode: TimeControl) -> Reply:
+    """
+    Build the reply for a per-time-control command like /rapid
+    """
+    stats = player.stats.mode(mode.name)
+    return _mode_reply(player.username, player.profile.avatar, mode, stats)
+
+
+@lru_cache(maxsize=4096)
+def _mode_reply(username: str, avatar, mode: TimeControl, stats: ModeStats) -> Reply:
+    label = mode.label.lower()
+    if stats is None:
+        return not_found(label)
+
+    embed = discord.Embed(
+        title=f"{username}'s {label} stats",
+        description=f"**Rating:** `{stats.rating}`\n**Wins:** `{stats.wins}`\n**Losses:** `{stats.losses}`\n**Draws:** `{stats.draws}`",
+        color=0x00FF00,
+    )
+    # set the thumbnail to the users avatar
+    embed.set_thumbnail(url=avatar)
+    if stats.best_rating is not None:
+        embed.add_field(
+            name="Highest rating", value=f"`{stats.best_rating}`", inline=True
+        )
+    if stats.best_game is not None:
+        embed.add_field(name="Best game", value=f"{stats.best_game}", inline=True)
+    return Reply(embed)
+
+
+def render_overview(player: Player) -> Reply:
+    """
+    Build the reply for /chess
+    """
+    profile = player.profile
+    stats = player.stats
+    modes = tuple(
+        (mode, stats.mode(mode.name))
+        for mode in TIME_CONTROLS.values()
+        if mode.overview
+    )
+    return _overview_reply(
+        player.username,
+        profile.avatar,
+        format_date(profile.joined),
+        profile.country or "Unknown",
+        format_last_online(profile.last_online),
+        modes,
+        stats.puzzle_rating,
+        format_date(stats.puzzle_date),
+    )
+
+
+@lru_cache(maxsize=4096)
+def _overview_reply(
+    username, avatar, joined, country, last_online, modes, puzzle, puzzle_date
+) -> Reply:
+    embed = discord.Embed(
+        title=f"{username}'s chess.com profile",
+        description=f"**Joined:** `{joined}`\n**Country:** `{country}`\n**Last online:** `{last_online}`",
+        color=0x00FF00,
+    )
+    # profile picture
+    embed.set_thumbnail(url=avatar)
+
+    for mode, stats in modes:
+        if stats is None:
+            continue
+        lines = [f"Rating: `{stats.rating}`"]
+        if stats.best_rating is not None:
+            lines.append(f"Best rating: `{stats.best_rating}`")
+        lines += [
+            f"Games played: `{stats.games}`",
+            f"Wins: `{stats.wins}`",
+            f"Losses: `{stats.losses}`",
+            f"Draws: `{stats.draws}`",
+        ]
+        embed.add_field(name=mode.label, value="\n".join(lines))
+
+    if puzzle is not None:
+        embed.add_field(
+            name="Puzzle", value=f"Highest: `{puzzle}`\nDate: `{puzzle_date}`"
+        )
+    return Reply(embed)
+
+
+def render_puzzle(player: Player) -> Reply:
+    """
+    Build the reply for /puzzle
+    """
+    return _puzzle_reply(
+        player.username,
+        player.profile.avatar,
+        player.stats.puzzle_rating,
+        format_date(player.stats.puzzle_date),
+    )
+
+
+@lru_cache(maxsize=4096)
+def _puzzle_reply(username, avatar, rating, date) -> Reply:
+    if rating is None:
+        return not_found("puzzle")
+    embed = discord.Embed(
+        title=f"{username}'s puzzle stats",
+        description=f"**Highest:** `{rating}`\n**Date:** `{date}`",
+        color=0x00FF00,
+    )
+    # set the thumbnail to the users avatar
+    embed.set_thumbnail(url=avatar)
+    return Reply(embed)
+
+
+def render_compare(results: dict) -> Reply:
+    """
+    Build the reply for /compare from username -> Player or ChessComError
+    """
+    players = [p for p in results.values() if isinstance(p, Player)]
+    failed = [
+        f"`{username}` ({'not found' if isinstance(e, PlayerNotFound) else 'chess.com error'})"
+        for username, e in results.items()
+        if not isinstance(e, Player)
+    ]
+    embed = discord.Embed(
+        title="Comparison",
+        description=" vs ".join(f"**{p.username}**" for p in players),
+        color=0x00FF00 if players else 0xFF0000,
+    )
+
+    for mode in TIME_CONTROLS.values():
+        rated = [
+            (stats.rating, player.username)
+            for player in players
+            if (stats := player.stats.mode(mode.name)) is not None
+        ]
+        if not rated:
+            continue
+        # best rating first
+        rated.sort(reverse=True)
+        lines = [
+            f"{i}. {username} `{rating}`"
+            for i, (rating, username) in enumerate(rated, 1)
+        ]
+        embed.add_field(name=mode.label, value="\n".join(lines))
+
+    puzzles = sorted(
+        (
+            (p.stats.puzzle_rating, p.username)
+            for p in players
+            if p.stats.puzzle_rating is not None
+        ),
+        reverse=True,
+    )
+    if puzzles:
+        lines = [
+            f"{i}. {username} `{rating}`"
+            for i, (rating, username) in enumerate(puzzles, 1)
+        ]
+        embed.add_field(name="Puzzle", value="\n".join(lines))
+
+    if failed:
+        embed.add_field(name="Couldn't load", value="\n".join(failed), inline=False)
+    return Reply(embed, ephemeral=not players)
+
+
+class LeaderboardView(discord.ui.View):
+    """
+    Previous/next buttons paging through a Board. Pages are sliced out of the
+    live board, so paging never rebuilds or re-sorts it.
+    """
+
+    def __init__(self, board: Board, mode: TimeControl, *, page_size: int = 10):
+        super().__init__(timeout=600)
+        self.board = board
+        self.mode = mode
+        self.page_size = page_size
+        self.page = 0
+        self.note = None
+        self.update_buttons()
+
+    @property
+    def pages(self) -> int:
+        return max(1, -(-len(self.board) // self.page_size))
+
+    def update_buttons(self):
+        self.page = min(self.page, self.pages - 1)
+        self.previous.disabled = self.page == 0
+        self.next.disabled = self.page >= self.pages - 1
+
+    def embed(self) -> discord.Embed:
+        rows = self.board.page(self.page, self.page_size)
+        embed = discord.Embed(
+            title=f"{self.mode.label} leaderboard",
+            description="\n".join(
+                f"`{rank}.` **{username}** `{rating}`"
+                for rank, username, rating in rows
+            )
+            or "Nobody here has a rating in this time control",
+            color=0x00FF00,
+        )
+        footer = f"Page {self.page + 1}/{self.pages} · {len(self.board)} players"
+        if self.note:
+            footer += f" · {self.note}"
+        embed.set_footer(text=footer)
+        return embed
+
+    async def show(self, interaction: discord.Interaction):
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        self.page -= 1
+        await self.show(interaction)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await self.show(interaction)
+
+
+def render_leaderboard(board: Board, mode: TimeControl, *, failed: int = 0) -> Reply:
+    """
+    Build the first page of /leaderboard, `failed` members couldn't be loaded
+    """
+    view = LeaderboardView(board, mode)
+    if failed:
+        view.note = f"{failed} couldn't be loaded"
+    return Reply(view.embed(), view=view if view.pages > 1 else None)
+
+
+# how results are shown in /form
+RESULT_SYMBOLS = {"win": "W", "draw": "D", "loss": "L"}
+
+
+def render_form(username: str, games: list, label: str = None) -> Reply:
+    """
+    Build the reply for /form from Game objects, newest first
+    """
+    what = f"{label.lower()} games" if label else "games"
+    if not games:
+        return not_found_games(username, what)
+    score = sum({"win": 1, "draw": 0.5}.get(game.result, 0) for game in games)
+    embed = discord.Embed(
+        title=f"{username}'s last {len(games)} {what}",
+        # oldest to newest reads like a timeline
+        description=" ".join(RESULT_SYMBOLS[game.result] for game in reversed(games))
+        + f"\n**Score:** `{score:g}/{len(games)}`",
+        color=0x00FF00,
+    )
+    lines = [
+        f"{RESULT_SYMBOLS[game.result]} vs {game.opponent} (`{game.opponent_rating}`)"
+        f" as {game.colour}, {game.time_class} · {format_date(game.end_time)}"
+        for game in games
+    ]
+    embed.add_field(name="Games", value="\n".join(lines), inline=False)
+    rated = [game.rating for game in games if game.rating is not None]
+    if len(rated) > 1 and all(g.time_class == games[0].time_class for g in games):
+        embed.add_field(name="Rating change", value=f"`{rated[0] - rated[-1]:+d}`")
+    return Reply(embed)
+
+
+def render_colours(username: str, rows, label: str = None) -> Reply:
+    """
+    Build the reply for /colours from `(colour, result, games)` rows
+    """
+    what = f"{label.lower()} games" if label else "games"
+    counts = {(colour, result): games for colour, result, games in rows}
+    if not counts:
+        return not_found_games(username, what)
+    embed = discord.Embed(
+        title=f"{username}'s results by colour",
+        description=f"All ingested {what}",
+        color=0x00FF00,
+    )
+    for colour in ("white", "black"):
+        wins, draws, losses = (
+            counts.get((colour, result), 0) for result in ("win", "draw", "loss")
+        )
+        total = wins + draws + losses
+        if not total:
+            continue
+        embed.add_field(
+            name=colour.capitalize(),
+            value=f"Games: `{total}`\nWin rate: `{wins / total:.1%}`\n"
+            f"Wins: `{wins}`\nDraws: `{draws}`\nLosses: `{losses}`",
+        )
+    return Reply(embed)
+
+
+def render_trend(username: str, rows, label: str = None, progress=None) -> Reply:
+    """
+    Build the reply for /trend from `(month, wins, draws, losses, rating)` rows,
+    newest first. `progress` is `(months ingested, months available)`.
+    """
+    what = f"{label.lower()} games" if label else "games"
+    if not rows:
+        return not_found_games(username, what)
+    lines = [
+        f"`{month}` {wins}W {draws}D {losses}L"
+        + (f" · `{rating}`" if label and rating is not None else "")
+        for month, wins, draws, losses, rating in rows
+    ]
+    embed = discord.Embed(
+        title=f"{username}'s {what} by month",
+        description="\n".join(lines),
+        color=0x00FF00,
+    )
+    if progress is not None:
+        embed.set_footer(text=f"{progress[0]} of {progress[1]} months loaded")
+    return Reply(embed)
+
+
+def not_found_games(username: str, what: str) -> Reply:
+    embed = discord.Embed(
+        title=f"No {what} found",
+        description=f"{username} hasn't played any {what} recently",
+        color=0xFF0000,
+    )
+    return Reply(embed)
+
+
+def render_openings(username: str, rows, label: str = None) -> Reply:
+    """
+    Build the reply for /openings from `(eco, name, games, wins, draws, losses)` rows
+    """
+    what = f"{label.lower()} games" if label else "games"
+    if not rows:
+        return not_found_games(username, what)
+    lines = [
+        f"`{eco or '?'}` {name or 'Unknown'}: `{games}` games, "
+        f"{wins}W {draws}D {losses}L ({wins / games:.0%})"
+        for eco, name, games, wins, draws, losses in rows
+    ]
+    embed = discord.Embed(
+        title=f"{username}'s most played openings",
+        description="\n".join(lines),
+        color=0x00FF00,
+    )
+    embed.set_footer(text=f"All ingested {what}")
+    return Reply(embed)
+
+
+def render_breakdown(username: str, rows) -> Reply:
+    """
+    Build the reply for /breakdown from `(time class, games, wins, draws, losses,
+    average moves)` rows
+    """
+    if not rows:
+        return not_found_games(username, "games")
+    embed = discord.Embed(
+        title=f"{username}'s games by time control",
+        description=f"**Games:** `{sum(row[1] for row in rows)}`",
+        color=0x00FF00,
+    )
+    for time_class, games, wins, draws, losses, moves in rows:
+        embed.add_field(
+            name=time_class.capitalize(),
+            value=f"Games: `{games}`\nWin rate: `{wins / games:.1%}`\n"
+            f"Wins: `{wins}`\nDraws: `{draws}`\nLosses: `{losses}`\n"
+            f"Average length: `{moves:.0f}` moves",
+        )
+    return Reply(embed)
+
+
+def render_head_to_head(username: str, opponent: str, result) -> Reply:
+    """
+    Build the reply for /h2h from `(games, wins, draws, losses, last end time,
+    by time class)`
+    """
+    games, wins, draws, losses, last, by_time_class = result
+    if not games:
+        embed = discord.Embed(
+            title="No games found",
+            description=f"{username} hasn't played {opponent} recently",
+            color=0xFF0000,
+        )
+        return Reply(embed)
+    embed = discord.Embed(
+        title=f"{username} vs {opponent}",
+        description=f"**Games:** `{games}`\n**Score:** `{wins}W {draws}D {losses}L`\n"
+        f"**Last game:** `{format_date(last)}`",
+        color=0x00FF00,
+    )
+    for time_class, wins, draws, losses in by_time_class:
+        embed.add_field(
+            name=time_class.capitalize(), value=f"`{wins}W {draws}D {losses}L`"
+        )
+    return Reply(embed)
+
+
+def render_presence(player: Player, came_online: bool, games: list) -> Reply:
+    """
+    Build the notification for followers of a player that came online or finished
+    games, `games` as `(time control name, rating, rating change)`
+    """
+    lines = []
+    for name, rating, change in games:
+        label = TIME_CONTROLS[name].label
+        delta = f" ({change:+d})" if change else ""
+        lines.append(f"Finished a **{label}** game, rating `{rating}`{delta}")
+    if came_online:
+        title = f"{player.username} is online"
+    else:
+        title = f"{player.username} finished a game"
+    embed = discord.Embed(
+        title=title,
+        description="\n".join(lines) or None,
+        color=0x00FF00,
+    )
+    embed.set_thumbnail(url=player.profile.avatar)
+    return Reply(embed)
+
+
+def _listing(lines: list, limit: int = 10) -> str:
+    """
+    The first `limit` lines, and how many more there are, within a field's 1024
+    characters
+    """
+    text = "\n".join(lines[:limit])
+    if len(lines) > limit:
+        text += f"\n...and {len(lines) - limit} more"
+    return text[:1024]
+
+
+def render_import(job, errors: list) -> Reply:
+    """
+    Build the progress report of /import, `errors` as the CSV lines that were skipped
+    """
+    done = job.phase == "Done"
+    embed = discord.Embed(
+        title="Import finished" if done else "Importing members",
+        description=f"{job.phase}: `{job.done}/{job.total}`",
+        color=0x00FF00 if done else 0xFFA500,
+    )
+    if job.players:
+        embed.add_field(name="Valid", value=f"`{len(job.players)}`")
+    if job.nicks:
+        embed.add_field(
+            name="Nicknames",
+            value=", ".join(
+                f"{outcome}: `{n}`" for outcome, n in sorted(job.nicks.items())
+            ),
+        )
+    if job.renamed:
+        lines = [
+            f"<@{user_id}> `{old}` is now `{new}`" for user_id, old, new in job.renamed
+        ]
+        embed.add_field(name="Renamed", value=_listing(lines), inline=False)
+    if job.invalid:
+        lines = [
+            f"<@{user_id}> `{name}` ({reason})" for user_id, name, reason in job.invalid
+        ]
+        embed.add_field(name="Not linked", value=_listing(lines), inline=False)
+    if errors:
+        lines = [f"Line {line}: {reason}" for line, reason in errors]
+        embed.add_field(name="Skipped lines", value=_listing(lines), inline=False)
+    return Reply(embed, ephemeral=True)
+
+
+def render_history(username: str, label: str, image: bytes) -> Reply:
+    """
+    Build the reply for /history around a rendered chart
+    """
+    embed = discord.Embed(title=f"{username}'s {label.lower()} rating", color=0x00FF00)
+    embed.set_image(url="attachment://history.png")
+    return Reply(embed, image=("history.png", image))
+
+
+def charts_unavailable() -> Reply:
+    embed = discord.Embed(
+        title="Charts aren't available",
+        description="The bot was set up without matplotlib",
+        color=0xFF0000,
+    )
+    return Reply(embed, ephemeral=True)
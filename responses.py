@@ -0,0 +1,126 @@
+import asyncio
+import io
+
+import discord
+
+
+class Reply:
+    """
+    What a command wants to answer with, independent of how it gets delivered
+    """
+
+    __slots__ = ("embed", "ephemeral", "view", "image")
+
+    def __init__(
+        self, embed: discord.Embed, *, ephemeral: bool = False, view=None, image=None
+    ):
+        self.embed = embed
+        self.ephemeral = ephemeral
+        # buttons and other components sent with the embed
+        self.view = view
+        # `(filename, bytes)` attached to the message, the embed can show it with
+        # `attachment://filename`
+        self.image = image
+
+
+async def respond(
+    interaction: discord.Interaction,
+    work,
+    *,
+    expected: float = 0,
+    ephemeral: bool = False,
+    defer_after: float = 1.5,
+    still_working_after: float = 8,
+):
+    """
+    Run `work` (an awaitable returning a Reply) and deliver the result.
+
+    Discord fails an interaction that isn't answered within 3 seconds, so if the
+    work is expected to take longer than `defer_after` (or actually does) the
+    interaction is deferred first and the result is delivered by editing the
+    deferred response. Cache hits (`expected == 0`) are answered directly.
+    `ephemeral` is whether a successful reply is expected to be ephemeral.
+    """
+    task = asyncio.ensure_future(work)
+    deferred = False
+    try:
+        if expected == 0:
+            reply = await task
+        else:
+            reply = None
+            if expected < defer_after:
+                done, _ = await asyncio.wait({task}, timeout=defer_after)
+                if done:
+                    reply = task.result()
+            if reply is None:
+                await interaction.response.defer(ephemeral=ephemeral, thinking=True)
+                deferred = True
+                reply = await _wait_deferred(interaction, task, still_working_after)
+    except Exception:
+        # answer anyway, a deferred "thinking" message would spin forever
+        try:
+            await send(interaction, failed_reply(), deferred_ephemeral=ephemeral)
+        except discord.HTTPException:
+            pass
+        raise
+    if not deferred:
+        return await send(interaction, reply)
+    return await send(interaction, reply, deferred_ephemeral=ephemeral)
+
+
+async def _wait_deferred(interaction: discord.Interaction, task, still_working_after):
+    """
+    Wait for the work of a deferred interaction, telling the user if it's slow
+    """
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), still_working_after)
+    except asyncio.TimeoutError:
+        await interaction.followup.send(
+            embed=discord.Embed(
+                title="Still working on it",
+                description="chess.com is slow right now, hang on",
+                color=0xFFA500,
+            ),
+            ephemeral=True,
+        )
+        return await task
+
+
+def failed_reply() -> Reply:
+    """
+    The reply when a command's work raised
+    """
+    # create embed
+    embed = discord.Embed(
+        title="Something went wrong",
+        description="The command failed, try again later",
+        color=0xFF0000,
+    )
+    return Reply(embed, ephemeral=True)
+
+
+async def send(
+    interaction: discord.Interaction, reply: Reply, *, deferred_ephemeral=False
+):
+    """
+    Deliver a reply as the initial response, or into the deferred one if there is one
+    """
+    view = reply.view or discord.utils.MISSING
+    files = discord.utils.MISSING
+    if reply.image is not None:
+        # a File can only be sent once, so it's made from the bytes on every send
+        filename, data = reply.image
+        files = [discord.File(io.BytesIO(data), filename)]
+    if not interaction.response.is_done():
+        return await interaction.response.send_message(
+            embed=reply.embed, ephemeral=reply.ephemeral, view=view, files=files
+        )
+    if reply.ephemeral == deferred_ephemeral:
+        return await interaction.edit_original_response(
+            embed=reply.embed, view=view, attachments=files
+        )
+    # the deferred "thinking" message has the wrong visibility for this reply
+    await interaction.delete_original_response()
+    return await interaction.followup.send(
+        embed=reply.embed, ephemeral=reply.ephemeral, view=view, files=files
+    )
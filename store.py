@@ -0,0 +1,534 @@
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# bump whenever the cache tables or the stored bodies change shape, old cached
+# data is dropped on open
+SCHEMA_VERSION = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    endpoint TEXT NOT NULL,
+    username TEXT NOT NULL,
+    body TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (endpoint, username)
+);
+CREATE INDEX IF NOT EXISTS responses_fetched_at ON responses (fetched_at);
+CREATE TABLE IF NOT EXISTS games (
+    username TEXT NOT NULL,
+    url TEXT NOT NULL,
+    end_time INTEGER NOT NULL,
+    time_class TEXT NOT NULL,
+    rules TEXT NOT NULL,
+    colour TEXT NOT NULL,
+    result TEXT NOT NULL,
+    rating INTEGER,
+    opponent TEXT,
+    opponent_rating INTEGER,
+    eco TEXT,
+    opening TEXT,
+    moves INTEGER,
+    PRIMARY KEY (username, url)
+);
+CREATE INDEX IF NOT EXISTS games_end_time ON games (username, end_time);
+CREATE TABLE IF NOT EXISTS archives (
+    username TEXT NOT NULL,
+    month TEXT NOT NULL,
+    complete INTEGER NOT NULL,
+    etag TEXT,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (username, month)
+);
+CREATE TABLE IF NOT EXISTS archive_players (
+    username TEXT PRIMARY KEY,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS archive_players_used ON archive_players (used);
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    paused_until REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS links (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    guilds TEXT NOT NULL DEFAULT '',
+    ranked TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS lookups (
+    username TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    last REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS follows (
+    user_id INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    guild_id INTEGER,
+    channel_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, username)
+);
+"""
+
+# tables that only cache chess.com data and can be rebuilt from it, as opposed to
+# what users told the bot (like their linked accounts)
+CACHE_TABLES = ("responses", "games", "archives", "archive_players")
+
+
+class Store:
+    """
+    Local SQLite database that keeps the bot's state across restarts.
+
+    sqlite3 is blocking, so every query runs on a single dedicated thread. That
+    keeps the event loop free and serialises access to the one connection.
+    """
+
+    def __init__(
+        self, path: str, *, max_responses: int = 50000, max_archive_players: int = 1000
+    ):
+        self.path = path
+        self.max_responses = max_responses
+        self.max_archive_players = max_archive_players
+        self.conn = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store")
+        self.writes = 0
+        self.archive_uses = 0
+
+    async def run(self, func, *args):
+        """
+        Run func(conn, *args) on the database thread
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, self.conn, *args)
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.conn = await loop.run_in_executor(self.executor, self._connect)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            # cached data written by another version of the bot can't be trusted
+            for table in CACHE_TABLES:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.executescript(SCHEMA)
+        # links aren't dropped with the cache, columns added to them since need
+        # adding to databases made before
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(links)")}
+        if "ranked" not in columns:
+            conn.execute("ALTER TABLE links ADD COLUMN ranked TEXT NOT NULL DEFAULT ''")
+        conn.commit()
+        return conn
+
+    async def close(self):
+        if self.conn is not None:
+            await self.run(lambda conn: conn.close())
+            self.conn = None
+        self.executor.shutdown(wait=False)
+
+    async def load_response(self, endpoint: str, username: str):
+        """
+        Return `(body, etag, last_modified, fetched_at)` or None if nothing is stored
+        """
+        row = await self.run(_load_response, endpoint, username)
+        if row is None:
+            return None
+        body, etag, last_modified, fetched_at = row
+        return json.loads(body), etag, last_modified, fetched_at
+
+    async def save_response(
+        self, endpoint: str, username: str, body, etag=None, last_modified=None
+    ):
+        row = (endpoint, username, json.dumps(body), etag, last_modified, time.time())
+        await self.run(_save_response, row)
+        self.writes += 1
+        # pruning is a full index scan, so only do it every so often
+        if self.writes % 100 == 0:
+            await self.run(_prune_responses, self.max_responses)
+
+    async def touch_response(self, endpoint: str, username: str):
+        """
+        Mark a stored response as freshly validated (after a 304)
+        """
+        await self.run(_touch_response, endpoint, username, time.time())
+
+    async def take_token(self, name: str, rate: float, burst: int):
+        """
+        Take a token from a bucket shared by every process using the database.
+        Returns `(seconds to wait before trying again, tokens left)`, 0 seconds
+        when a token was taken.
+        """
+        return await self.run(_take_token, name, rate, burst)
+
+    async def refund_token(self, name: str, burst: int) -> float:
+        """
+        Put a token taken with take_token back, returning the tokens left
+        """
+        return await self.run(_refund_token, name, burst)
+
+    async def pause_bucket(self, name: str, seconds: float):
+        """
+        Hand out no tokens from a shared bucket for a while
+        """
+        await self.run(_pause_bucket, name, time.time() + seconds)
+
+    async def claim(self, key: str, owner: str, ttl: float) -> bool:
+        """
+        Take a lease on `key` for `ttl` seconds unless another owner holds it
+        """
+        return await self.run(_claim, key, owner, time.time(), ttl)
+
+    async def release(self, key: str, owner: str):
+        await self.run(_release, key, owner)
+
+    async def load_meta(self, key: str):
+        """
+        Return a value saved with save_meta, or None
+        """
+        return await self.run(_load_meta, key)
+
+    async def save_meta(self, key: str, value: str):
+        await self.run(_save_meta, key, value)
+
+    async def load_usernames(self):
+        """
+        Return the properly capitalised names of the players with a stored profile
+        """
+        return await self.run(_load_usernames)
+
+    async def load_links(self):
+        """
+        Return every `(user_id, username, guilds)` row
+        """
+        return await self.run(_load_links)
+
+    async def save_links(self, rows, deleted):
+        """
+        Upsert `(user_id, username, guilds)` rows and delete the deleted user ids
+        """
+        await self.run(_save_links, rows, deleted)
+
+    async def load_top_lookups(self, limit: int) -> list:
+        """
+        Return the `limit` most looked up usernames, most first
+        """
+        rows = await self.run(_load_top_lookups, limit)
+        return [username for (username,) in rows]
+
+    async def save_lookups(self, counts: dict):
+        """
+        Add username -> lookups to the lookup history
+        """
+        await self.run(_save_lookups, list(counts.items()), time.time())
+
+    async def load_follows(self):
+        """
+        Return every `(user_id, username, guild_id, channel_id)` row
+        """
+        return await self.run(_load_follows)
+
+    async def save_follow(self, row):
+        await self.run(_save_follow, row)
+
+    async def delete_follow(self, user_id: int, username: str):
+        await self.run(_delete_follow, user_id, username)
+
+    async def use_archives(self, username: str):
+        """
+        Mark a player's archived games as used, the least recently used players'
+        games are dropped beyond `max_archive_players`
+        """
+        await self.run(_use_archives, username, time.time())
+        self.archive_uses += 1
+        # like the responses, only pruned every so often
+        if self.archive_uses % 20 == 0:
+            await self.run(_prune_archives, self.max_archive_players)
+
+    async def load_archives(self, username: str) -> dict:
+        """
+        Return month -> `(complete, etag, fetched_at)` for the ingested archives
+        """
+        rows = await self.run(_load_archives, username)
+        return {month: (bool(complete), etag, at) for month, complete, etag, at in rows}
+
+    async def save_games(
+        self, username: str, rows, month=None, *, complete=False, etag=None
+    ):
+        """
+        Upsert Game rows for a player. With `month`, also checkpoint that archive in
+        the same transaction, `complete` once every game in it is saved.
+        """
+        checkpoint = None
+        if month is not None:
+            checkpoint = (username, month, complete, etag, time.time())
+        await self.run(_save_games, username, rows, checkpoint)
+
+    async def load_games(self, username: str, *, time_class=None, limit: int = 10):
+        """
+        Return the latest Game rows of a player, newest first
+        """
+        return await self.run(_load_games, username, time_class, limit)
+
+    async def load_colour_results(self, username: str, *, time_class=None):
+        """
+        Return `(colour, result, games)` rows
+        """
+        return await self.run(_load_colour_results, username, time_class)
+
+    async def load_monthly_results(self, username: str, *, time_class=None, months=12):
+        """
+        Return `(month, wins, draws, losses, last rating)` rows for the latest
+        months, newest first
+        """
+        rows = await self.run(_load_monthly_results, username, time_class, months)
+        return [row[:5] for row in rows]
+
+
+def _load_response(conn, endpoint, username):
+    return conn.execute(
+        "SELECT body, etag, last_modified, fetched_at FROM responses"
+        " WHERE endpoint = ? AND username = ?",
+        (endpoint, username),
+    ).fetchone()
+
+
+def _save_response(conn, row):
+    conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", row)
+    conn.commit()
+
+
+def _touch_response(conn, endpoint, username, fetched_at):
+    conn.execute(
+        "UPDATE responses SET fetched_at = ? WHERE endpoint = ? AND username = ?",
+        (fetched_at, endpoint, username),
+    )
+    conn.commit()
+
+
+def _prune_responses(conn, max_rows):
+    # drop the least recently fetched rows beyond the limit
+    conn.execute(
+        "DELETE FROM responses WHERE rowid IN ("
+        " SELECT rowid FROM responses ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+        (max_rows,),
+    )
+    conn.commit()
+
+
+def _take_token(conn, name, rate, burst):
+    now = time.time()
+    # IMMEDIATE takes the write lock up front, so two processes can't both read
+    # the same token count and take the same token
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT tokens, updated, paused_until FROM buckets WHERE name = ?", (name,)
+        ).fetchone()
+        tokens, updated, paused_until = row if row else (burst, now, 0.0)
+        tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+        if now < paused_until:
+            wait = paused_until - now
+        elif tokens < 1:
+            wait = (1 - tokens) / rate
+        else:
+            tokens -= 1
+            wait = 0.0
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)",
+            (name, tokens, now, paused_until),
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return wait, tokens
+
+
+def _refund_token(conn, name, burst):
+    conn.execute(
+        "UPDATE buckets SET tokens = MIN(?, tokens + 1) WHERE name = ?", (burst, name)
+    )
+    conn.commit()
+    row = conn.execute("SELECT tokens FROM buckets WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else burst
+
+
+def _pause_bucket(conn, name, until):
+    conn.execute(
+        "UPDATE buckets SET paused_until = MAX(paused_until, ?) WHERE name = ?",
+        (until, name),
+    )
+    conn.commit()
+
+
+def _claim(conn, key, owner, now, ttl):
+    # replace the lease only if it's ours or has expired
+    cursor = conn.execute(
+        "INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE"
+        " SET owner = excluded.owner, expires = excluded.expires"
+        " WHERE leases.owner = excluded.owner OR leases.expires < ?",
+        (key, owner, now + ttl, now),
+    )
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+def _release(conn, key, owner):
+    conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+    conn.commit()
+
+
+def _load_meta(conn, key):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _save_meta(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+    conn.commit()
+
+
+def _load_usernames(conn):
+    # the first element of a stored profile row is the username
+    rows = conn.execute(
+        "SELECT json_extract(body, '$[0]') FROM responses WHERE endpoint = 'profile'"
+    )
+    return [username for (username,) in rows if username]
+
+
+def _load_links(conn):
+    return conn.execute(
+        "SELECT user_id, username, guilds, ranked FROM links"
+    ).fetchall()
+
+
+def _save_links(conn, rows, deleted):
+    conn.executemany("INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?)", rows)
+    conn.executemany("DELETE FROM links WHERE user_id = ?", [(i,) for i in deleted])
+    conn.commit()
+
+
+def _load_top_lookups(conn, limit):
+    return conn.execute(
+        "SELECT username FROM lookups ORDER BY count DESC LIMIT ?", (limit,)
+    ).fetchall()
+
+
+def _save_lookups(conn, counts, now):
+    conn.executemany(
+        "INSERT INTO lookups VALUES (?, ?, ?) ON CONFLICT (username) DO UPDATE"
+        " SET count = count + excluded.count, last = excluded.last",
+        [(username, count, now) for username, count in counts],
+    )
+    conn.commit()
+
+
+def _load_follows(conn):
+    return conn.execute(
+        "SELECT user_id, username, guild_id, channel_id FROM follows"
+    ).fetchall()
+
+
+def _save_follow(conn, row):
+    conn.execute("INSERT OR REPLACE INTO follows VALUES (?, ?, ?, ?)", row)
+    conn.commit()
+
+
+def _delete_follow(conn, user_id, username):
+    conn.execute(
+        "DELETE FROM follows WHERE user_id = ? AND username = ?", (user_id, username)
+    )
+    conn.commit()
+
+
+def _use_archives(conn, username, used):
+    conn.execute(
+        "INSERT OR REPLACE INTO archive_players VALUES (?, ?)", (username, used)
+    )
+    conn.commit()
+
+
+def _prune_archives(conn, max_players):
+    # drop the games and checkpoints of the least recently used players beyond
+    # the limit
+    stale = [
+        row[0]
+        for row in conn.execute(
+            "SELECT username FROM archive_players ORDER BY used DESC LIMIT -1 OFFSET ?",
+            (max_players,),
+        )
+    ]
+    for table in ("games", "archives", "archive_players"):
+        conn.executemany(
+            f"DELETE FROM {table} WHERE username = ?", [(name,) for name in stale]
+        )
+    conn.commit()
+
+
+def _load_archives(conn, username):
+    return conn.execute(
+        "SELECT month, complete, etag, fetched_at FROM archives WHERE username = ?",
+        (username,),
+    ).fetchall()
+
+
+def _save_games(conn, username, rows, checkpoint):
+    conn.executemany(
+        "INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(username,) + row for row in rows],
+    )
+    if checkpoint is not None:
+        conn.execute(
+            "INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?, ?)", checkpoint
+        )
+    conn.commit()
+
+
+# every query below filters by username and optionally by time class
+GAMES_WHERE = "WHERE username = ? AND (? IS NULL OR time_class = ?)"
+
+
+def _load_games(conn, username, time_class, limit):
+    return conn.execute(
+        "SELECT url, end_time, time_class, rules, colour, result, rating, opponent,"
+        " opponent_rating, eco, opening, moves"
+        f" FROM games {GAMES_WHERE} ORDER BY end_time DESC LIMIT ?",
+        (username, time_class, time_class, limit),
+    ).fetchall()
+
+
+def _load_colour_results(conn, username, time_class):
+    return conn.execute(
+        f"SELECT colour, result, COUNT(*) FROM games {GAMES_WHERE}"
+        " GROUP BY colour, result",
+        (username, time_class, time_class),
+    ).fetchall()
+
+
+def _load_monthly_results(conn, username, time_class, months):
+    # with MAX() SQLite takes the bare rating column from the month's last game
+    return conn.execute(
+        "SELECT strftime('%Y-%m', end_time, 'unixepoch') AS month,"
+        " SUM(result = 'win'), SUM(result = 'draw'), SUM(result = 'loss'),"
+        f" rating, MAX(end_time) FROM games {GAMES_WHERE}"
+        " GROUP BY month ORDER BY month DESC LIMIT ?",
+        (username, time_class, time_class, months),
+    ).fetchall()
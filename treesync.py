@@ -0,0 +1,35 @@
+import hashlib
+import json
+
+from discord import app_commands
+
+
+def fingerprint(tree: app_commands.CommandTree, guild=None) -> str:
+    """
+    Hash of the payload tree.sync would upload for a guild (None for global)
+    """
+    commands = sorted(
+        (command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+        key=lambda command: (command.get("type", 1), command["name"]),
+    )
+    # a different application has none of our commands yet
+    payload = json.dumps(
+        [tree.client.application_id, commands], sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def sync_if_changed(
+    tree: app_commands.CommandTree, store, guild=None, *, force: bool = False
+) -> bool:
+    """
+    Sync the commands of a guild (None for global) unless they're the same as
+    at the last sync, returning whether they were synced
+    """
+    key = f"tree:{guild.id if guild is not None else 'global'}"
+    digest = fingerprint(tree, guild)
+    if not force and await store.load_meta(key) == digest:
+        return False
+    await tree.sync(guild=guild)
+    await store.save_meta(key, digest)
+    return True
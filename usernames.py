@@ -0,0 +1,88 @@
+import heapq
+from bisect import bisect_left, insort
+
+# Discord shows at most 25 autocomplete choices
+TOP_SIZE = 25
+
+
+class UsernameIndex:
+    """
+    Prefix index of chess.com usernames the bot has seen, for autocomplete.
+
+    Lowercase names are kept in a sorted list, so the names starting with a
+    prefix are one contiguous slice found with two bisects. Suggestions are
+    ranked by how often a name was looked up. Never does any I/O.
+    """
+
+    def __init__(self, max_names: int = 50000):
+        self.max_names = max_names
+        self.names = []
+        # lowercase name -> [properly capitalised name, lookups]
+        self.entries = {}
+        # names that never get evicted (linked accounts)
+        self.pinned = set()
+        # the most looked up names overall, what an empty prefix completes to.
+        # Ranking every name is the slowest query, so it's kept until a lookup
+        # could change it.
+        self.top = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def record(self, username: str, *, pinned: bool = False):
+        """
+        Count a lookup of a player that exists
+        """
+        key = username.lower()
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [username, 0]
+            insort(self.names, key)
+        entry[0] = username
+        entry[1] += 1
+        if self.top is not None and (
+            len(self.top) < TOP_SIZE
+            or entry[1] >= self.entries[self.top[-1].lower()][1]
+        ):
+            self.top = None
+        if pinned:
+            self.pinned.add(key)
+        if len(self.names) > self.max_names:
+            self.prune()
+
+    def complete(self, prefix: str, limit: int = 25) -> list:
+        """
+        The most looked up names starting with `prefix`, best first
+        """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            if self.top is None:
+                self.top = self.rank(self.names, TOP_SIZE)
+            return self.top[:limit]
+        start = bisect_left(self.names, prefix)
+        # every name with the prefix sorts before prefix + the highest code point
+        end = bisect_left(self.names, prefix + "\U0010ffff", start)
+        return self.rank(self.names[start:end], limit)
+
+    def rank(self, names, limit: int) -> list:
+        best = heapq.nlargest(
+            limit, names, key=lambda name: (self.entries[name][1], name)
+        )
+        return [self.entries[name][0] for name in best]
+
+    def prune(self):
+        """
+        Drop the least looked up tenth of the unpinned names
+        """
+        unpinned = [name for name in self.names if name not in self.pinned]
+        drop = set(
+            heapq.nsmallest(
+                len(self.names) // 10 or 1,
+                unpinned,
+                key=lambda name: self.entries[name][1],
+            )
+        )
+        for name in drop:
+            del self.entries[name]
+        self.names = [name for name in self.names if name not in drop]
+        self.top = None